@@ -1,38 +1,122 @@
+import time
+
+# Measurement time, taken before the other imports, so they count towards the time to the first response
+start_time = time.time()
+
+import argparse
 import os.path
+import threading
+import uuid
 import dash
 import dash_bootstrap_components as dbc
+import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
-import pickle
+import flask
+from dash.dependencies import Input, Output, State, MATCH
+from dash.exceptions import PreventUpdate
 import util.helpers
-from util import datamodel
 from util import components
-import time
-
-# Measurement time
-start_time = time.time()
+from util import datamodel
+from util import metrics
+from util import photometry
+from util import plots
+from util import profiling
+from util import pyramid
+from util import registry
+from util import watcher
+from util import zoomqueue
+
+# Command line options
+parser = argparse.ArgumentParser()
+parser.add_argument('--data-path', default='./Output/',
+                    help='folder with the simulation runs (default: ./Output/)')
+parser.add_argument('--memory-budget', type=float, default=None,
+                    help='maximal memory in MB held by loaded data models (default: no limit)')
+parser.add_argument('--cache-dir', default='./Cache/',
+                    help='directory of the derived products cache (default: ./Cache/)')
+parser.add_argument('--no-cache', action='store_true',
+                    help='always recompute derived products from the fits-files')
+parser.add_argument('--trace-memory', action='store_true',
+                    help='measure and print the peak memory of each data model build')
+parser.add_argument('--max-models', type=int, default=None,
+                    help='maximal number of data models kept in memory (default: 4, no limit with --workers)')
+parser.add_argument('--workers', type=int, default=1,
+                    help='build the data models of all runs at startup in N worker processes (default: 1, lazy)')
+parser.add_argument('--stream-threshold', type=float, default=1024,
+                    help='analyze images larger than this many MB in streaming mode (default: 1024)')
+parser.add_argument('--watch', type=float, default=10,
+                    help='poll for new, changed or removed runs every N seconds (default: 10, 0 to disable)')
+parser.add_argument('--mask-box', type=int, default=None,
+                    help='edge length in pixels of the box masked around each source (default: 100)')
+parser.add_argument('--mask-radius', type=float, default=None,
+                    help='mask a disk with this radius in beams around each source instead of a box')
+parser.add_argument('--profile-log', default=None,
+                    help='append the timing and memory of every stage and callback to this json-lines file')
+parser.add_argument('--fast-start', action='store_true',
+                    help='answer with a shell layout right away and fill in the cards once the first model is built')
+parser.add_argument('--precomputed', action='store_true',
+                    help='only serve the runs precomputed into the cache directory by precompute.py')
+parser.add_argument('--zoom-workers', type=int, default=zoomqueue.ZOOM_WORKERS,
+                    help='number of threads computing zoomed views (default: %d)' % zoomqueue.ZOOM_WORKERS)
+args, _ = parser.parse_known_args()
+if args.precomputed and args.no_cache:
+    parser.error('--precomputed reads the runs from the cache, it cannot be combined with --no-cache')
+profiling.profiler.configure(args.profile_log)
 
 # data for data model
-data_path = './Output/'
-models = dict()
-index = 0
-for folder in os.listdir(data_path):
-    if folder.startswith("vla_c"):
-        with open(data_path + folder + "/sources.pkl", "rb") as inputfile:
-            sources = pickle.load(inputfile)
-            directions = []
-            for source in sources:
-                direction = (source['sp_direction_ra'], source['sp_direction_dec'])
-                directions.append(direction)
-        models.update({folder: datamodel.Datamodel(data_path + folder + "/FITS_Files/", directions, folder, index)})
-        index += 1
-
-model = models[next(iter(models))]
+data_path = os.path.join(args.data_path, '')
+memory_budget = None if args.memory_budget is None else int(args.memory_budget * 1024 ** 2)
+cache_dir = None if args.no_cache else args.cache_dir
+if args.mask_radius is not None:
+    mask_settings = {'radius': args.mask_radius}
+elif args.mask_box is not None:
+    mask_settings = {'box': args.mask_box}
+else:
+    mask_settings = None
+stream_bytes = int(args.stream_threshold * 1024 ** 2)
+# models preloaded by worker processes are all kept unless a limit is given
+if args.max_models is not None:
+    max_models = args.max_models
+else:
+    max_models = None if args.workers > 1 and __name__ == '__main__' else registry.MAX_MODELS
+models = registry.ModelRegistry(data_path, memory_budget, cache_dir, args.trace_memory, mask_settings,
+                                max_models, stream_bytes, args.precomputed)
+print("Time to scan runs:")
+print("--- %s seconds ---" % (time.time() - start_time))
+
+# worker processes must not preload again when they import this module
+if args.workers > 1 and __name__ == '__main__':
+    models.preload(args.workers)
+
+# forked worker processes of a WSGI server start their own watcher on the first poll of the browser
+run_watcher = None
+if args.watch > 0 and __name__ == '__main__':
+    run_watcher = watcher.ensure_watching(run_watcher, models, args.watch)
+
+# seconds from the start to the first response and to the first served analysis cards
+startup_times = {'first_response': None, 'fully_loaded': None}
+
+# without runs yet, the dashboard starts with loading cards and the watcher fills the dropdown once runs are complete
+first_folder = next(iter(models), None)
+if first_folder is None:
+    print('no %s run found in %s' % ('precomputed' if args.precomputed else 'complete', data_path))
+    initial_model = None
+elif args.fast_start:
+    # the first model is built in the background while the server answers with the shell layout, forked worker
+    # processes of a WSGI server build it in the first callback instead
+    initial_model = None
+    if __name__ == '__main__':
+        threading.Thread(target=models.get, args=(first_folder,), name='InitialModel', daemon=True).start()
+else:
+    # the first model is only built for the initial layout, it is not kept alive by this module
+    initial_model = models.get(first_folder)
 print("Time to create objects:")
 print("--- %s seconds ---" % (time.time() - start_time))
 
 # ****************************************************************************************
 
+layout_time = time.time()
+
 # CSS
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -45,20 +129,38 @@ colors = {
 # Card for Dropdown
 dropdownCard = components.dropdown_card(models)
 
-# Card for observing images
-img_sky = app.get_asset_url('Skymodel.png')
-img_psf = app.get_asset_url('psf.png')
-observeCard = components.observing_card(img_sky, img_psf)
+# Card for observing images, the plots are rendered when a run is selected
+renderer = plots.PlotRenderer(os.path.join(app.config.assets_folder, 'plots'))
+observeCard = components.observing_card()
+
+# Card for analyzing plots, placeholders in fast-start mode or without runs until the callback fills them
+if initial_model is None:
+    flatCard, residualCard, fidelityCard = [components.loading_card(name) for _, name, _ in datamodel.IMAGE_FILES]
+else:
+    flatCard = components.analyze_card(initial_model.flat)
+    residualCard = components.analyze_card(initial_model.residual)
+    fidelityCard = components.analyze_card(initial_model.fidelity)
+del initial_model
+
+# Card for the photometry of the catalog sources, measured when a run is selected
+photometryCard = components.photometry_card()
 
-# Card for analyzing plots
-flatCard = components.analyze_card(model.flat)
-residualCard = components.analyze_card(model.residual)
-fidelityCard = components.analyze_card(model.fidelity)
+# Card for comparing runs, filled from the metrics index of the cache
+compareCard = components.comparison_card()
+metrics_index = None if cache_dir is None else metrics.MetricsIndex(cache_dir)
+metric_labels = {column: label for column, label, _ in metrics.PARAMETERS}
+metric_labels.update(metrics.METRICS)
+
+# zoom events are computed in a thread pool, coalesced per session and image
+zoom_queue = zoomqueue.ZoomQueue(args.zoom_workers)
+
+# image attribute of the data model by card name
+image_attributes = {name: attribute for attribute, name, _ in datamodel.IMAGE_FILES}
 
 # ****************************************************************************************
 
 # Layout
-app.layout = html.Div(style={'backgroundColor': '#F0F1F9', 'width': '100%', 'height': '100%'}, children=[
+static_layout = html.Div(style={'backgroundColor': '#F0F1F9', 'width': '100%', 'height': '100%'}, children=[
 
     html.Div(children=[
         html.H1(children='Simulated Radio Observation', style={'color': colors['text'], 'padding': '4rem',
@@ -66,45 +168,77 @@ app.layout = html.Div(style={'backgroundColor': '#F0F1F9', 'width': '100%', 'hei
     ]),
 
     html.Div(children=[
-        dbc.Row([
-            # *************
-            # Output folder dropdown
-            dbc.Col([
-                html.Div([dropdownCard],
-                         className="row", style={'margin': '1.5rem'}),
-            ], width=12),
+        dcc.Tabs(id='tabs', value='analysis', children=[
+            dcc.Tab(label='Analysis', value='analysis', children=[
+                dbc.Row([
+                    # *************
+                    # Output folder dropdown
+                    dbc.Col([
+                        html.Div([dropdownCard],
+                                 className="row", style={'margin': '1.5rem'}),
+                        dcc.Interval(id='watch-interval', interval=max(args.watch, 1) * 1000, disabled=args.watch <= 0),
+                    ], width=12),
+
+                    # *************
+                    # Observe output (Skymodel & PSF)
+                    dbc.Col([
+                        html.Div([observeCard],
+                                 className="row", style={'margin': '1.5rem'}),
+                    ], width=12)
+                ], className="row"),
+
+                # *************
+                # Analysis
+                html.Div([
+                    dbc.Row([flatCard], id='card_flat')
+                ], className="row", style={'margin': '1.5rem'}),
+
+                html.Div([
+                    dbc.Row([residualCard], id='card_residual')
+                ], className="row", style={'margin': '1.5rem'}),
+
+                html.Div([
+                    dbc.Row([fidelityCard], id='card_fidelity')
+                ], className="row", style={'margin': '1.5rem'}),
+
+                # *************
+                # Photometry of the catalog sources
+                html.Div([photometryCard], className="row", style={'margin': '1.5rem'})
+            ]),
 
             # *************
-            # Observe output (Skymodel & PSF)
-            dbc.Col([
-                html.Div([observeCard],
-                         className="row", style={'margin': '1.5rem'}),
-            ], width=12)
-        ], className="row"),
-
-        # *************
-        # Analysis
-        html.Div([
-            dbc.Row([flatCard], id='card_flat')
-        ], className="row", style={'margin': '1.5rem'}),
-
-        html.Div([
-            dbc.Row([residualCard], id='card_residual')
-        ], className="row", style={'margin': '1.5rem'}),
-
-        html.Div([
-            dbc.Row([fidelityCard], id='card_fidelity')
-        ], className="row", style={'margin': '1.5rem'})
+            # Comparison of all runs
+            dcc.Tab(label='Comparison', value='comparison', children=[
+                html.Div([compareCard], className="row", style={'margin': '1.5rem'})
+            ])
+        ])
     ], style={'margin': '3em'}),
 ])
 
 
+def serve_layout():
+    """
+    Returns the layout for a new page load. Only the session id is created per page, it identifies the zoom events of
+    a browser tab to coalesce them.
+
+    :return: layout: The layout with a new session id
+    """
+    return html.Div([dcc.Store(id='session', data=uuid.uuid4().hex), static_layout])
+
+
+app.layout = serve_layout
+
+print("Time to create layout:")
+print("--- %s seconds ---" % (time.time() - layout_time))
+
+
 # ****************************************************************************************
 @app.callback(
     [Output('card_flat', 'children'),
      Output('card_residual', 'children'),
      Output('card_fidelity', 'children')],
     [Input('dropdown', 'value')])
+@profiling.profiler.callback
 def load_data(folder):
     """
     Returns loaded data model image.
@@ -112,86 +246,277 @@ def load_data(folder):
     :param folder: The given folder
     :return: image cards: All images card of flat, residual and fidelity
     """
-    model = models[folder]
+    if folder not in models:
+        raise PreventUpdate
+    model = models.get(folder)
     flat_card = components.analyze_card(model.flat)
     residual_card = components.analyze_card(model.residual)
     fidelity_card = components.analyze_card(model.fidelity)
+    if startup_times['fully_loaded'] is None:
+        startup_times['fully_loaded'] = time.time() - start_time
+        print("Time to fully load:")
+        print("--- %s seconds ---" % startup_times['fully_loaded'])
     return flat_card, residual_card, fidelity_card
 
 
 @app.callback(
-    Output(model.flat.name + "-hist", 'figure'),
-    [Input(model.flat.name + "-image", 'relayoutData')])
-def update_hist(relayoutData):
+    [Output('skymodel-image', 'src'),
+     Output('psf-image', 'src')],
+    [Input('dropdown', 'value')])
+@profiling.profiler.callback
+def load_plots(folder):
     """
-    Updates histogram when specific region was selected on flat image.
+    Returns the urls of the skymodel and psf plots of the selected run. The plots are rendered in the thread pool of
+    the plot renderer unless they are up-to-date.
 
-    :param relayoutData: The re-layouted data
-    :return: fig: Updated histogram figure
+    :param folder: The given folder
+    :return: img_sky: The url of the sky-model image
+    :return: img_psf: The url of the psf image
     """
-    if relayoutData is None:
-        fig = model.flat.hist
-    else:
-        if 'xaxis.range[0]' in relayoutData:
-            x0 = int(round(relayoutData['xaxis.range[0]']))
-            x1 = int(round(relayoutData['xaxis.range[1]']))
-            y0 = int(round(relayoutData['yaxis.range[0]']))
-            y1 = int(round(relayoutData['yaxis.range[1]']))
-            data = model.flat.data[x0:x1, y0:y1]
-            fig = util.helpers.create_hist(data, 'Flat Distribution')
-        else:
-            fig = model.flat.hist
-    return fig
+    if folder not in models:
+        raise PreventUpdate
+    futures = renderer.render_run(folder, data_path + folder + "/FITS_Files/" + folder)
+    return [app.get_asset_url('plots/' + futures[attribute].result()) for attribute, _, _ in plots.PLOT_FILES]
 
 
 @app.callback(
-    Output(model.residual.name + "-hist", 'figure'),
-    [Input(model.residual.name + "-image", 'relayoutData')])
-def update_hist(relayoutData):
+    [Output('dropdown', 'options'),
+     Output('dropdown', 'value')],
+    [Input('watch-interval', 'n_intervals')],
+    [State('dropdown', 'options'),
+     State('dropdown', 'value')])
+@profiling.profiler.callback
+def update_runs(n_intervals, options, folder):
+    """
+    Updates the dropdown options when the watcher found new or removed runs. If the selected run was removed, the
+    first run is selected.
+
+    :param n_intervals: The number of polls
+    :param options: The current dropdown options
+    :param folder: The selected folder
+    :return: options: The updated dropdown options
+    :return: folder: The selected folder
     """
-    Updates histogram when specific region was selected on residual image.
+    global run_watcher
+    if args.watch > 0:
+        run_watcher = watcher.ensure_watching(run_watcher, models, args.watch)
+    new_options = components.dropdown_options(models)
+    if new_options == options:
+        raise PreventUpdate
+    if folder in models:
+        return new_options, dash.no_update
+    return new_options, new_options[0]['value'] if new_options else None
 
+
+@app.callback(
+    [Output('photometry-scatter', 'figure'),
+     Output('photometry-status', 'children'),
+     Output('photometry-table', 'page_current')],
+    [Input('dropdown', 'value')])
+@profiling.profiler.callback
+def load_photometry(folder):
+    """
+    Returns the scatter plot of the photometry of the catalog sources of the selected run and shows the first page of
+    its table.
+
+    :param folder: The given folder
+    :return: scatter: The scatter plot of measured against catalog flux
+    :return: status: The number of sources
+    :return: page: The first page of the table
+    """
+    if folder not in models:
+        raise PreventUpdate
+    with profiling.profiler.run(folder):
+        measurements = models.get(folder).photometry()
+    scatter = util.helpers.photometry_figure(measurements, 'Measured vs. Catalog Flux')
+    return scatter, '%d sources of the catalog' % len(measurements['name']), 0
+
+
+@app.callback(
+    [Output('photometry-table', 'data'),
+     Output('photometry-table', 'page_count')],
+    [Input('dropdown', 'value'),
+     Input('photometry-table', 'page_current'),
+     Input('photometry-table', 'page_size'),
+     Input('photometry-table', 'sort_by')])
+@profiling.profiler.callback
+def update_photometry_table(folder, page_current, page_size, sort_by):
+    """
+    Returns one page of the photometry table of the selected run, sorted by the selected column. Only the rows of the
+    page are sent, so the table stays fast for catalogs of tens of thousands of sources.
+
+    :param folder: The given folder
+    :param page_current: The page number
+    :param page_size: The number of rows per page
+    :param sort_by: The sorted column and direction
+    :return: data: The rows of the page
+    :return: page_count: The number of pages
+    """
+    if folder not in models:
+        raise PreventUpdate
+    with profiling.profiler.run(folder):
+        measurements = models.get(folder).photometry()
+    return photometry.sorted_page(measurements, sort_by, page_current or 0, page_size)
+
+
+@app.callback(
+    [Output('compare-table', 'data'),
+     Output('compare-scatter', 'figure'),
+     Output('compare-status', 'children')],
+    [Input('tabs', 'value'),
+     Input('compare-image', 'value'),
+     Input('compare-x', 'value'),
+     Input('compare-y', 'value')])
+@profiling.profiler.callback
+def update_comparison(tab, image, x, y):
+    """
+    Updates the comparison of all runs when the comparison tab is opened or the image or axes are changed. The metrics
+    index is brought up to date with the cache first, then the metrics of the runs in the output folder are read from
+    the index, no fits-file is opened.
+
+    :param tab: The selected tab
+    :param image: The compared image
+    :param x: The column of the x-axis
+    :param y: The column of the y-axis
+    :return: data: The rows of the table
+    :return: scatter: The scatter plot
+    :return: status: The number of compared runs
+    """
+    if tab != 'comparison':
+        raise PreventUpdate
+    if metrics_index is None:
+        return [], dash.no_update, 'The comparison is read from the cache, which is disabled (--no-cache).'
+    metrics_index.update()
+    rows = metrics_index.query(image, list(models))
+    scatter = util.helpers.comparison_figure(rows, x, y, metric_labels, image + ': ' + metric_labels[y] + ' vs. ' +
+                                             metric_labels[x])
+    return rows, scatter, '%d of %d runs analyzed, runs are added once their model was built.' % (len(rows),
+                                                                                                    len(models))
+
+
+def update_view(image, relayoutData):
+    """
+    Returns the histogram and the image figure of the region selected on the given image. The histogram is read from
+    the region index of the image and the image is served from the pyramid level matching the zoom.
+
+    :param image: The casa image
     :param relayoutData: The re-layouted data
     :return: fig: Updated histogram figure
+    :return: view: Updated image figure
     """
-    if relayoutData is None:
-        fig = model.residual.hist
-    else:
-        if 'xaxis.range[0]' in relayoutData:
-            x0 = int(round(relayoutData['xaxis.range[0]']))
-            x1 = int(round(relayoutData['xaxis.range[1]']))
-            y0 = int(round(relayoutData['yaxis.range[0]']))
-            y1 = int(round(relayoutData['yaxis.range[1]']))
-            data = model.residual.data[x0:x1, y0:y1]
-            fig = util.helpers.create_hist(data, 'Flat Distribution')
-        else:
-            fig = model.residual.hist
-    return fig
+    if relayoutData is not None and 'xaxis.autorange' in relayoutData:
+        return image.hist, image.image
+    region = util.helpers.relayout_region(relayoutData, image.data.shape)
+    if region is None:
+        return image.hist, dash.no_update
+    x0, x1, y0, y1 = region
+    if x1 <= x0 or y1 <= y0:
+        return dash.no_update, dash.no_update
+    fig = util.helpers.hist_figure(image.index.region(x0, x1, y0, y1), image.name + ' Distribution')
+    view = pyramid.create_view(image.pyramid, image.name + '-Image', region)
+    return fig, view
 
 
 @app.callback(
-    Output(model.fidelity.name + "-hist", 'figure'),
-    [Input(model.fidelity.name + "-image", 'relayoutData')])
-def update_hist(relayoutData):
+    [Output({'type': 'hist', 'index': MATCH}, 'figure'),
+     Output({'type': 'image', 'index': MATCH}, 'figure'),
+     Output({'type': 'onsource_hist', 'index': MATCH}, 'figure'),
+     Output({'type': 'offsource_hist', 'index': MATCH}, 'figure'),
+     Output({'type': 'stats', 'index': MATCH}, 'children')],
+    [Input({'type': 'image', 'index': MATCH}, 'relayoutData'),
+     Input({'type': 'channel', 'index': MATCH}, 'value')],
+    [State('dropdown', 'value'),
+     State('session', 'data')])
+@profiling.profiler.callback
+def update_hist(relayoutData, channel, folder, session):
     """
-    Updates histogram when specific region was selected on fidelity image.
+    Updates histogram and image when specific region was selected on the flat, residual or fidelity image of the
+    model selected in the dropdown. When another channel of a cube is selected, the zoomed region is kept and the
+    histograms and statistical information of the whole channel are updated as well. The views are computed in the
+    zoom queue: a request replaced by a newer one of the same session and image is not answered.
 
     :param relayoutData: The re-layouted data
+    :param channel: The selected channel
+    :param folder: The selected folder
+    :param session: The session id of the browser tab
     :return: fig: Updated histogram figure
+    :return: view: Updated image figure
+    :return: hist_onsource: Updated on-source histogram figure
+    :return: hist_offsource: Updated off-source histogram figure
+    :return: stats: Updated statistical information
+    """
+    name = dash.callback_context.outputs_list[0]['id']['index']
+    if folder not in models or name not in image_attributes:
+        raise PreventUpdate
+    channel = channel or 0
+    memo_key = (folder, models.signatures.get(folder), name, channel, util.helpers.zoom_key(relayoutData))
+    try:
+        fig, view = zoom_queue.run((session, name), memo_key, compute_view, folder, name, channel, relayoutData)
+    except zoomqueue.Superseded:
+        raise PreventUpdate
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if not any(prop_id.endswith('.value') for prop_id in triggered):
+        return fig, view, dash.no_update, dash.no_update, dash.no_update
+    image = getattr(models.get(folder), image_attributes[name]).channel(channel)
+    if view is dash.no_update:
+        view = image.image
+    return fig, view, image.hist_onsource, image.hist_offsource, components.stats_columns(image)
+
+
+def compute_view(folder, name, channel, relayoutData):
+    """
+    Returns the histogram and the image figure of a zoom event. Runs in a thread of the zoom queue.
+
+    :param folder: The selected folder
+    :param name: The name of the image
+    :param channel: The selected channel
+    :param relayoutData: The re-layouted data
+    :return: fig: Updated histogram figure
+    :return: view: Updated image figure
+    """
+    with profiling.profiler.run(folder):
+        image = getattr(models.get(folder), image_attributes[name]).channel(channel)
+        return update_view(image, relayoutData)
+
+
+@app.server.after_request
+def first_response(response):
+    """
+    Reports the time from the start to the first response of this server process.
+
+    :param response: The response
+    :return: response: The unchanged response
+    """
+    if startup_times['first_response'] is None:
+        startup_times['first_response'] = time.time() - start_time
+        print("Time to first response:")
+        print("--- %s seconds ---" % startup_times['first_response'])
+    return response
+
+
+@app.server.route('/status')
+def status():
+    """
+    Returns the process id, the memory, the loaded models, the startup times and the depth of the zoom queue of this
+    server process, e.g. to compare the worker processes of a WSGI server. Memory-mapped arrays are part of the shared
+    memory and not of the model memory.
+
+    :return: response: The status as json
+    """
+    rss, shared = profiling.process_memory()
+    return flask.jsonify({'pid': os.getpid(), 'rss_bytes': rss, 'shared_bytes': shared, 'model_bytes': models.nbytes(),
+                          'models': list(models.models), 'runs': list(models), 'uptime': time.time() - start_time,
+                          'startup': startup_times, 'zoom': zoom_queue.stats()})
+
+
+@app.server.route('/profile')
+def profile():
+    """
+    Returns the count, percentiles and memory of the stages of every run and of every callback of this server process.
+
+    :return: response: The profile as json
     """
-    if relayoutData is None:
-        fig = model.fidelity.hist
-    else:
-        if 'xaxis.range[0]' in relayoutData:
-            x0 = int(round(relayoutData['xaxis.range[0]']))
-            x1 = int(round(relayoutData['xaxis.range[1]']))
-            y0 = int(round(relayoutData['yaxis.range[0]']))
-            y1 = int(round(relayoutData['yaxis.range[1]']))
-            data = model.fidelity.data[x0:x1, y0:y1]
-            fig = util.helpers.create_hist(data, 'Flat Distribution')
-        else:
-            fig = model.fidelity.hist
-    return fig
+    return flask.jsonify(profiling.profiler.summary())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,336 @@
+"""
+Benchmark of the dashboard load and interaction latency on synthetic simulation runs.
+
+Run from the AppDash folder, e.g.:
+    python benchmark.py --sizes 256 1024 4096 --sources 1 100 --output benchmark.json
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import plotly
+from astropy.io import fits
+from astropy.wcs import WCS
+
+import loadtest
+from util import cache
+from util import datamodel
+from util import helpers
+from util import pyramid
+from util import regionstats
+from util import registry
+from util import stats
+
+# Pixel size of the synthetic images in degrees
+CDELT = 1 / 3600
+
+# Beam axes of the synthetic images in pixels (FWHM)
+BEAM = (4.0, 3.0)
+
+
+#########################
+# Synthetic Runs
+#########################
+
+def create_header(size, channels=1):
+    """
+    Returns the fits-header of a synthetic CASA image with a SIN projection centered on the phase center. Cubes get a
+    Stokes and a frequency axis like CASA images.
+
+    :param size: The edge length of the image in pixels
+    :param channels: The number of frequency channels
+    :return: header: The fits-header
+    """
+    header = fits.Header()
+    header['CTYPE1'], header['CRVAL1'], header['CDELT1'], header['CRPIX1'] = 'RA---SIN', 180.0, -CDELT, size / 2 + 1
+    header['CTYPE2'], header['CRVAL2'], header['CDELT2'], header['CRPIX2'] = 'DEC--SIN', -30.0, CDELT, size / 2 + 1
+    header['CUNIT1'] = header['CUNIT2'] = 'deg'
+    header['RADESYS'], header['EQUINOX'] = 'FK5', 2000.0
+    header['BMAJ'], header['BMIN'], header['BPA'] = BEAM[0] * CDELT, BEAM[1] * CDELT, 0.0
+    header['BUNIT'] = 'Jy/beam'
+    if channels > 1:
+        header['CTYPE3'], header['CRVAL3'], header['CDELT3'], header['CRPIX3'] = 'STOKES', 1.0, 1.0, 1.0
+        header['CTYPE4'], header['CRVAL4'], header['CDELT4'], header['CRPIX4'] = 'FREQ', 1e9, 1e6, 1.0
+        header['CUNIT4'] = 'Hz'
+    return header
+
+
+def paint_sources(image, pixels, fluxes):
+    """
+    Adds elliptical gaussian beams with the given peak fluxes at the given pixel coordinates to the image.
+
+    :param image: The image data
+    :param pixels: The pixel coordinates (row, column) of the sources
+    :param fluxes: The peak fluxes of the sources
+    """
+    sigma = np.array(BEAM) / 2.3548
+    extent = int(np.ceil(4 * sigma.max()))
+    dy, dx = np.mgrid[-extent:extent + 1, -extent:extent + 1]
+    stamp = np.exp(-0.5 * ((dy / sigma[1]) ** 2 + (dx / sigma[0]) ** 2)).ravel()
+    centers = np.rint(pixels).astype('i8')
+    rows = (centers[:, 0:1] + dy.ravel()).ravel()
+    columns = (centers[:, 1:2] + dx.ravel()).ravel()
+    values = (fluxes[:, None] * stamp).ravel()
+    valid = (rows >= 0) & (rows < image.shape[0]) & (columns >= 0) & (columns < image.shape[1])
+    np.add.at(image, (rows[valid], columns[valid]), values[valid].astype(image.dtype))
+
+
+def write_run(data_path, folder, size, nsources, seed=0, channels=1):
+    """
+    Writes a synthetic simulation run in the layout of the Output folder: the five fits-files in FITS_Files and the
+    source catalog in sources.pkl. Cubes get fresh noise in each channel and sources with a spectral index of -0.7.
+
+    :param data_path: The output folder
+    :param folder: The folder name of the run
+    :param size: The edge length of the images in pixels
+    :param nsources: The number of sources
+    :param seed: The seed of the random numbers
+    :param channels: The number of frequency channels
+    """
+    rng = np.random.default_rng(seed)
+    header = create_header(size, channels)
+    wcs = WCS(header).celestial
+    pixels = rng.uniform(0.05 * size, 0.95 * size, (nsources, 2))
+    ra, dec = wcs.wcs_pix2world(pixels[:, 1], pixels[:, 0], 0)
+    fluxes = rng.uniform(0.1, 1.0, nsources)
+
+    images = {suffix: np.zeros((channels, size, size), dtype='f4')
+              for suffix in ('.skymodel.fits', '.psf.fits', '.image.flat.fits', '.residual.fits', '.fidelity.fits')}
+    for channel in range(channels):
+        scale = (1 + channel * 1e-3) ** -0.7
+        skymodel = images['.skymodel.fits'][channel]
+        paint_sources(skymodel, pixels, fluxes * scale)
+        residual = images['.residual.fits'][channel]
+        residual[:] = rng.standard_normal((size, size)) * 0.01
+        flat = images['.image.flat.fits'][channel]
+        flat[:] = residual
+        paint_sources(flat, pixels, fluxes * scale)
+        images['.fidelity.fits'][channel] = np.abs(flat) / (np.abs(flat - skymodel) + 0.01)
+        paint_sources(images['.psf.fits'][channel], np.array([[size / 2, size / 2]]), np.array([1.0]))
+
+    path = os.path.join(data_path, folder, 'FITS_Files', '')
+    os.makedirs(path, exist_ok=True)
+    for suffix, data in images.items():
+        data = data[:, np.newaxis] if channels > 1 else data[0]
+        fits.PrimaryHDU(data, header).writeto(path + folder + suffix, overwrite=True)
+
+    sources = []
+    for index in range(nsources):
+        sources.append({'Name': 'Source' + str(index + 1), 'sp_direction_ra': float(ra[index]),
+                        'sp_direction_dec': float(dec[index]), 'sp_flux': float(fluxes[index]), 'sp_fluxunit': 'Jy',
+                        'sp_shape': 'point'})
+    with open(os.path.join(data_path, folder, 'sources.pkl'), 'wb') as outputfile:
+        pickle.dump(sources, outputfile)
+
+
+#########################
+# Measurement
+#########################
+
+def timed(function, *args, repeat=1):
+    """
+    Calls the function repeatedly and returns the last result with the median and minimum time.
+
+    :param function: The function
+    :param args: The arguments of the function
+    :param repeat: The number of calls
+    :return: result: The result of the last call
+    :return: timing: The median and minimum time in seconds
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start_time)
+    return result, {'median': statistics.median(times), 'min': min(times)}
+
+
+def payload_size(value):
+    """
+    Returns the number of bytes of the given figure or component as sent to the browser.
+
+    :param value: The figure, component or list of them
+    :return: nbytes: The size of the JSON payload
+    """
+    return len(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def benchmark_stages(path, directions, repeat):
+    """
+    Times the stages of building a casa image from a fits-file in the order of casa_image.compute.
+
+    :param path: The path of the fits-file
+    :param directions: The directions from given sources
+    :param repeat: The number of calls per stage
+    :return: result: The time of each stage and the payload sizes of the figures
+    """
+    result = dict()
+    hdulist, result['fits_open'] = timed(fits.open, path, repeat=repeat)
+    data, result['data'] = timed(helpers.get_FITS_data, hdulist, repeat=repeat)
+    header = hdulist[0].header
+    result['source_mask'] = timed(lambda: helpers.create_source_mask(header, data.shape, directions, {'box': 99}),
+                                  repeat=repeat)[1]
+    mask = helpers.create_source_mask(header, data.shape, directions)
+    levels, result['pyramid'] = timed(pyramid.build_pyramid, data, repeat=repeat)
+    image, result['create_image'] = timed(pyramid.create_view, levels, 'Image', repeat=repeat)
+    record, result['stats'] = timed(stats.fused_stats, data, repeat=repeat)
+    result['stats_masked'] = timed(lambda: stats.fused_stats(data, mask, median=False), repeat=repeat)[1]
+    hist, result['create_hist'] = timed(helpers.create_hist, data, 'Distribution', repeat=repeat)
+    result['region_index'] = timed(regionstats.RegionIndex, data, record.edges, repeat=repeat)[1]
+    result['image_bytes'] = payload_size(image)
+    result['hist_bytes'] = payload_size(hist)
+    hdulist.close()
+    return result
+
+
+def benchmark_model(data_path, folder, directions, cache_dir):
+    """
+    Times building a data model without cache, with a cold cache and with a warm cache.
+
+    :param data_path: The output folder
+    :param folder: The folder name of the run
+    :param directions: The directions from given sources
+    :param cache_dir: The cache directory
+    :return: result: The build times and the memory of the model
+    """
+    path = os.path.join(data_path, folder, 'FITS_Files', '')
+    result = dict()
+    model, result['build'] = timed(datamodel.Datamodel, path, directions, folder, 0)
+    result['model_bytes'] = registry.model_nbytes(model)
+    result['model_memory'] = registry.model_memory(model)
+    result['build_cold_cache'] = timed(datamodel.Datamodel, path, directions, folder, 0, cache_dir)[1]
+    result['build_warm_cache'] = timed(datamodel.Datamodel, path, directions, folder, 0, cache_dir)[1]
+    result['cache_bytes'] = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(cache_dir)
+                                for name in names if os.path.relpath(root, cache_dir).startswith(folder)
+                                or name.startswith(folder))
+    return result
+
+
+def post_callback(client, body):
+    """
+    Posts a callback request to the test client of the app server.
+
+    :param client: The test client
+    :param body: The callback request
+    :return: nbytes: The size of the response
+    """
+    response = client.post('/_dash-update-component', json=body)
+    if response.status_code != 200:
+        raise RuntimeError('callback request failed with status %d' % response.status_code)
+    return len(response.data)
+
+
+def benchmark_callbacks(app, folders, repeat):
+    """
+    Times the dropdown and zoom callbacks of the app by posting their requests to the test client of the server, so
+    the zoom queue, the serialization of the figures and the request handling are included. Every repetition of a zoom
+    is shifted by one pixel, so it is computed and not answered from the memoized views; the last region is posted
+    once more to time a memoized view.
+
+    :param app: The imported app module
+    :param folders: The folder names of the runs
+    :param repeat: The number of calls per callback
+    :return: result: The latency and payload size per run
+    """
+    client = app.app.server.test_client()
+    result = dict()
+    for folder in folders:
+        body = loadtest.dropdown_request(folder)
+        post_callback(client, body)
+        nbytes, load_time = timed(post_callback, client, body, repeat=repeat)
+        ny, nx = app.models.get(folder).flat.data.shape
+        zooms = {'zoom_full': (0, nx, 0, ny), 'zoom_half': (nx // 4, 3 * nx // 4, ny // 4, 3 * ny // 4),
+                 'zoom_small': (nx // 2 - 32, nx // 2 + 32, ny // 2 - 32, ny // 2 + 32)}
+        result[folder] = {'load_data': load_time, 'load_data_bytes': nbytes}
+        for name, (x0, x1, y0, y1) in zooms.items():
+            bodies = [loadtest.zoom_request(folder, 'Flat', (x0 + shift, x1 + shift, y0 + shift, y1 + shift),
+                                            'benchmark') for shift in range(repeat)]
+            pending = iter(bodies)
+            nbytes, result[folder][name] = timed(lambda: post_callback(client, next(pending)), repeat=repeat)
+            result[folder][name + '_bytes'] = nbytes
+            result[folder][name + '_memo'] = timed(post_callback, client, bodies[-1])[1]
+    return result
+
+
+def git_revision():
+    """
+    Returns the current git revision of the repository or None outside a git checkout.
+
+    :return: revision: The revision
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#########################
+# Main
+#########################
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of dashboard load and interaction latency.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024],
+                        help='edge lengths of the synthetic images in pixels')
+    parser.add_argument('--sources', type=int, nargs='+', default=[1, 100],
+                        help='numbers of sources per run')
+    parser.add_argument('--channels', type=int, default=1, help='number of frequency channels per run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of calls per measurement')
+    parser.add_argument('--output', default='benchmark.json', help='json-file of the results')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic runs')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='dashapp-benchmark-')
+    data_path = os.path.join(work_dir, 'Output', '')
+    cache_dir = os.path.join(work_dir, 'Cache', '')
+    runs = dict()
+    for size in args.sizes:
+        for nsources in args.sources:
+            folder = 'vla_c-bench-s_%d-n_%d' % (size, nsources)
+            print('writing synthetic run ' + folder)
+            write_run(data_path, folder, size, nsources, channels=args.channels)
+            runs[folder] = {'size': size, 'sources': nsources, 'channels': args.channels}
+
+    results = {'revision': git_revision(), 'python': platform.python_version(), 'numpy': np.__version__,
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'cache_version': cache.CACHE_VERSION,
+               'runs': runs}
+    try:
+        for folder in runs:
+            directions = registry.load_directions(data_path + folder + '/sources.pkl')
+            path = data_path + folder + '/FITS_Files/' + folder + '.image.flat.fits'
+            runs[folder]['stages'] = benchmark_stages(path, directions, args.repeat)
+            runs[folder]['model'] = benchmark_model(data_path, folder, directions, cache_dir)
+
+        # the app builds the first run on import
+        sys.argv = ['app.py', '--data-path', data_path, '--cache-dir', cache_dir]
+        start_time = time.perf_counter()
+        import app
+        results['app_import'] = time.perf_counter() - start_time
+        for folder, result in benchmark_callbacks(app, list(runs), args.repeat).items():
+            runs[folder]['callbacks'] = result
+        results['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    finally:
+        if args.keep:
+            print('synthetic runs kept in ' + work_dir)
+        else:
+            shutil.rmtree(work_dir)
+
+    with open(args.output, 'w') as outputfile:
+        json.dump(results, outputfile, indent=2)
+    print('results written to ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Load test of a running dashboard with concurrent clients switching runs in the dropdown and zooming into the images.
+Reports throughput, latency percentiles, the memory and the zoom queue of every server process, e.g.:
+    python loadtest.py --url http://127.0.0.1:8000 --clients 8 --requests 50 --output loadtest.json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Names of the analyzed images as used in the ids of the graphs
+IMAGES = ('Flat', 'Residual', 'Fidelity')
+
+
+#########################
+# Requests
+#########################
+
+def post(url, body):
+    """
+    Posts a callback request to the dashboard.
+
+    :param url: The url of the dashboard
+    :param body: The callback request
+    :return: nbytes: The size of the response
+    """
+    request = urllib.request.Request(url + '/_dash-update-component', data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return len(response.read())
+
+
+def get_status(url):
+    """
+    Returns the status of the server process answering the request.
+
+    :param url: The url of the dashboard
+    :return: status: The status
+    """
+    with urllib.request.urlopen(url + '/status') as response:
+        return json.loads(response.read())
+
+
+def dropdown_request(folder):
+    """
+    Returns the callback request of selecting a run in the dropdown.
+
+    :param folder: The folder name of the run
+    :return: body: The callback request
+    """
+    outputs = [{'id': 'card_' + name.lower(), 'property': 'children'} for name in IMAGES]
+    return {'output': '..' + '...'.join(output['id'] + '.children' for output in outputs) + '..',
+            'outputs': outputs,
+            'inputs': [{'id': 'dropdown', 'property': 'value', 'value': folder}],
+            'changedPropIds': ['dropdown.value']}
+
+
+def zoom_request(folder, name, region, session='loadtest'):
+    """
+    Returns the callback request of zooming into an image.
+
+    :param folder: The folder name of the run selected in the dropdown
+    :param name: The name of the image
+    :param region: The zoomed region (x0, x1, y0, y1)
+    :param session: The session id of the browser tab, zooms of one session into one image are coalesced
+    :return: body: The callback request
+    """
+    x0, x1, y0, y1 = region
+    relayout = {'xaxis.range[0]': x0, 'xaxis.range[1]': x1, 'yaxis.range[0]': y0, 'yaxis.range[1]': y1}
+    image_id = {'type': 'image', 'index': name}
+    outputs = [{'id': {'type': kind, 'index': name}, 'property': prop} for kind, prop in
+               (('hist', 'figure'), ('image', 'figure'), ('onsource_hist', 'figure'), ('offsource_hist', 'figure'),
+                ('stats', 'children'))]
+    return {'output': '..' + '...'.join('{"index":["MATCH"],"type":"%s"}.%s' % (output['id']['type'],
+                                                                              output['property'])
+                                         for output in outputs) + '..',
+            'outputs': outputs,
+            'inputs': [{'id': image_id, 'property': 'relayoutData', 'value': relayout},
+                       {'id': {'type': 'channel', 'index': name}, 'property': 'value', 'value': 0}],
+            'state': [{'id': 'dropdown', 'property': 'value', 'value': folder},
+                      {'id': 'session', 'property': 'data', 'value': session}],
+            'changedPropIds': [json.dumps(image_id, separators=(',', ':'), sort_keys=True) + '.relayoutData']}
+
+
+#########################
+# Clients
+#########################
+
+def run_client(url, runs, requests, zooms, size, seed):
+    """
+    Runs one client: it selects a random run and zooms into its images a few times, until the given number of
+    requests is sent.
+
+    :param url: The url of the dashboard
+    :param runs: The folder names of the runs
+    :param requests: The number of requests
+    :param zooms: The number of zoom requests per selected run
+    :param size: The edge length of the images in pixels, regions are clipped by the server
+    :param seed: The seed of the random choices
+    :return: timings: The kind, latency in seconds and response size of each request
+    """
+    rng = random.Random(seed)
+    timings = []
+    folder = None
+    for number in range(requests):
+        if number % (zooms + 1) == 0:
+            folder = rng.choice(runs)
+            kind, body = 'dropdown', dropdown_request(folder)
+        else:
+            width = rng.randint(16, size)
+            x0, y0 = rng.randint(0, size - width), rng.randint(0, size - width)
+            kind, body = 'zoom', zoom_request(folder, rng.choice(IMAGES), (x0, x0 + width, y0, y0 + width),
+                                              'loadtest-%d' % seed)
+        start_time = time.perf_counter()
+        nbytes = post(url, body)
+        timings.append((kind, time.perf_counter() - start_time, nbytes))
+    return timings
+
+
+def summarize(latencies):
+    """
+    Returns the number, mean and percentiles of the given latencies.
+
+    :param latencies: The latencies in seconds
+    :return: summary: The summary
+    """
+    if not latencies:
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'count': len(latencies), 'mean': statistics.mean(latencies), 'p50': p50, 'p95': p95, 'p99': p99}
+
+
+#########################
+# Main
+#########################
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of a running dashboard.')
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='url of the dashboard')
+    parser.add_argument('--clients', type=int, default=4, help='number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=50, help='number of requests per client')
+    parser.add_argument('--zooms', type=int, default=4, help='number of zoom requests per selected run')
+    parser.add_argument('--size', type=int, default=1024, help='edge length of the images in pixels')
+    parser.add_argument('--output', default=None, help='json-file of the results')
+    args = parser.parse_args()
+    url = args.url.rstrip('/')
+
+    runs = get_status(url)['runs']
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as executor:
+        futures = [executor.submit(run_client, url, runs, args.requests, args.zooms, args.size, seed)
+                   for seed in range(args.clients)]
+        timings = [timing for future in futures for timing in future.result()]
+    seconds = time.perf_counter() - start_time
+
+    # repeated status requests reach every worker process of the server
+    processes = dict()
+    for _ in range(16 * args.clients):
+        status = get_status(url)
+        processes[status['pid']] = status
+
+    results = {'url': url, 'clients': args.clients, 'requests': len(timings), 'seconds': seconds,
+               'throughput': len(timings) / seconds,
+               'dropdown': summarize([latency for kind, latency, _ in timings if kind == 'dropdown']),
+               'zoom': summarize([latency for kind, latency, _ in timings if kind == 'zoom']),
+               'response_bytes': sum(nbytes for _, _, nbytes in timings),
+               'processes': list(processes.values())}
+    print("Throughput of %d clients:" % args.clients)
+    print("--- %.1f requests per second ---" % results['throughput'])
+    for kind in ('dropdown', 'zoom'):
+        if results[kind]['count']:
+            print("Latency of %s requests (p50, p95):" % kind)
+            print("--- %.3f, %.3f seconds ---" % (results[kind]['p50'], results[kind]['p95']))
+    for status in results['processes']:
+        print("Memory of process %d with %d models:" % (status['pid'], len(status['models'])))
+        print("--- %.1f MB resident, %.1f MB shared ---" % (status['rss_bytes'] / 1024 ** 2,
+                                                         (status['shared_bytes'] or 0) / 1024 ** 2))
+        zoom = status.get('zoom')
+        if zoom is not None:
+            print("Zoom queue of process %d (max queued, cancelled, superseded, memo hits):" % status['pid'])
+            print("--- %d, %d, %d, %d ---" % (zoom['max_queued'], zoom['cancelled'], zoom['superseded'],
+                                           zoom['memo_hits']))
+    if args.output is not None:
+        with open(args.output, 'w') as outputfile:
+            json.dump(results, outputfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Precomputes the derived products of all simulation runs offline, so the dashboard only loads them, e.g. from the
+repository root:
+    python -m AppDash.precompute --workers 8
+
+The masks, pyramids, statistics, region indices, spectra and photometry of every run are written to the cache
+directory by the same pipeline as in the dashboard, the skymodel and psf plots to the plots folder of the assets.
+Runs whose files and settings are unchanged since they were precomputed are skipped. Serve the precomputed runs with
+    python app.py --precomputed
+using the same --cache-dir, --stream-threshold and mask options.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# the modules of the dashboard are imported from the util package next to this file, like in app.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from util import cache
+from util import datamodel
+from util import metrics
+from util import plots
+from util import registry
+
+# Folder of this file, the default paths are the ones of the dashboard started in it
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+#########################
+# Precompute Functions
+#########################
+
+def precompute_run(data_path, folder, directions, cache_dir, mask_settings, stream_bytes, plots_dir):
+    """
+    Computes and caches the derived products of one run and renders its plots. Runs in a worker process.
+
+    :param data_path: The path of the output folder
+    :param folder: The folder name
+    :param directions: The directions from given sources
+    :param cache_dir: The directory of the derived products cache
+    :param mask_settings: The settings of the source mask (None for the default boxes)
+    :param stream_bytes: The size in bytes above which images are analyzed in streaming mode (None for never)
+    :param plots_dir: The directory of the png-files of the plots (None to skip the plots)
+    :return: seconds: The time needed for the run
+    """
+    start_time = time.time()
+    model = datamodel.Datamodel(data_path + folder + "/FITS_Files/", directions, folder, 0, cache_dir,
+                                mask_settings=mask_settings, stream_bytes=stream_bytes)
+    model.photometry()
+    if plots_dir is not None:
+        renderer = plots.PlotRenderer(plots_dir, workers=1)
+        for future in renderer.render_run(folder, data_path + folder + "/FITS_Files/" + folder).values():
+            future.result()
+        renderer.executor.shutdown()
+    return time.time() - start_time
+
+
+def precompute(models, workers, plots_dir, force=False):
+    """
+    Precomputes all runs of the registry that are not up-to-date in a process pool. The list of precomputed runs is
+    saved after each run, so an interrupted job continues where it stopped.
+
+    :param models: The model registry of the runs
+    :param workers: The number of worker processes
+    :param plots_dir: The directory of the png-files of the plots (None to skip the plots)
+    :param force: Boolean initialized with False, precomputes up-to-date runs as well
+    :return: done: The folder names of the precomputed runs
+    :return: failed: The folder names of the runs that could not be precomputed
+    """
+    start_time = time.time()
+    manifest = cache.load_manifest(models.cache_dir)
+    entries = {folder: registry.manifest_entry(models.signatures[folder], models.mask_settings, models.stream_bytes)
+               for folder in models}
+    for folder in list(manifest):
+        if folder not in entries:
+            del manifest[folder]
+    todo = [folder for folder in models if force or manifest.get(folder) != entries[folder]]
+    print("%d of %d runs are up-to-date, precomputing %d with %d workers" % (len(entries) - len(todo), len(entries),
+                                                                            len(todo), workers))
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork') if 'fork' in methods else None
+    done, failed = [], []
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        futures = {executor.submit(precompute_run, models.data_path, folder, models.runs[folder], models.cache_dir,
+                                   models.mask_settings, models.stream_bytes, plots_dir): folder for folder in todo}
+        for future in as_completed(futures):
+            folder = futures[future]
+            try:
+                seconds = future.result()
+            except Exception as error:
+                print('cannot precompute run %s: %r' % (folder, error))
+                manifest.pop(folder, None)
+                failed.append(folder)
+                continue
+            manifest[folder] = entries[folder]
+            cache.save_manifest(models.cache_dir, manifest)
+            done.append(folder)
+            print("Time to precompute run %s (%d of %d):" % (folder, len(done), len(todo)))
+            print("--- %s seconds ---" % seconds)
+    cache.save_manifest(models.cache_dir, manifest)
+
+    metrics.MetricsIndex(models.cache_dir).update()
+    print("Time to precompute %d runs:" % len(done))
+    print("--- %s seconds ---" % (time.time() - start_time))
+    return done, failed
+
+
+#########################
+# Main
+#########################
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute the derived products of all simulation runs.')
+    parser.add_argument('--data-path', default=os.path.join(APP_DIR, 'Output'),
+                        help='folder with the simulation runs (default: AppDash/Output)')
+    parser.add_argument('--cache-dir', default=os.path.join(APP_DIR, 'Cache'),
+                        help='directory of the derived products cache (default: AppDash/Cache)')
+    parser.add_argument('--plots-dir', default=os.path.join(APP_DIR, 'assets', 'plots'),
+                        help='directory of the skymodel and psf plots (default: AppDash/assets/plots)')
+    parser.add_argument('--no-plots', action='store_true', help='do not render the skymodel and psf plots')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: number of cpus)')
+    parser.add_argument('--force', action='store_true', help='precompute up-to-date runs as well')
+    parser.add_argument('--stream-threshold', type=float, default=1024,
+                        help='analyze images larger than this many MB in streaming mode (default: 1024)')
+    parser.add_argument('--mask-box', type=int, default=None,
+                        help='edge length in pixels of the box masked around each source (default: 100)')
+    parser.add_argument('--mask-radius', type=float, default=None,
+                        help='mask a disk with this radius in beams around each source instead of a box')
+    args = parser.parse_args()
+
+    if args.mask_radius is not None:
+        mask_settings = {'radius': args.mask_radius}
+    elif args.mask_box is not None:
+        mask_settings = {'box': args.mask_box}
+    else:
+        mask_settings = None
+    models = registry.ModelRegistry(os.path.join(args.data_path, ''), cache_dir=args.cache_dir,
+                                    mask_settings=mask_settings, stream_bytes=int(args.stream_threshold * 1024 ** 2))
+    done, failed = precompute(models, max(args.workers, 1), None if args.no_plots else args.plots_dir, args.force)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import plotly.io as pio
+
+# Bump when the stored products change so old entries are rebuilt
+CACHE_VERSION = 12
+
+# Arrays stored in files larger than this are memory-mapped instead of read into memory
+MMAP_BYTES = 2 ** 16
+
+# File name of the list of runs precomputed by precompute.py in the cache directory
+MANIFEST_FILE = 'precomputed.json'
+
+# Suffix of the lock files of runs being built into the cache directory
+LOCK_SUFFIX = '.lock'
+
+
+#########################
+# Cache Keys
+#########################
+
+def cache_key(path, directions, settings=None):
+    """
+    Returns the cache key of a fits-file. The key changes whenever the file is modified, the sources move or the
+    settings change.
+
+    :param path: The path of the fits-file
+    :param directions: The directions from given sources
+    :param settings: The settings the products depend on
+    :return: key: The hex digest of the key
+    """
+    stat = os.stat(path)
+    key = [os.path.abspath(path), stat.st_mtime_ns, stat.st_size, [[float(ra), float(dec)] for ra, dec in directions],
+           settings, CACHE_VERSION]
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def entry_prefix(cache_dir, path):
+    """
+    Returns the prefix shared by all cache entries of a fits-file.
+
+    :param cache_dir: The cache directory
+    :param path: The path of the fits-file
+    :return: prefix: The path prefix of the entries
+    """
+    path_hash = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, os.path.basename(path) + '.' + path_hash)
+
+
+#########################
+# Loading & Saving
+#########################
+
+def load_array(path):
+    """
+    Returns an array stored in a npy-file. Large arrays are memory-mapped read-only, so processes loading the same
+    entry share the pages of the file instead of holding private copies.
+
+    :param path: The path of the npy-file
+    :return: array: The array
+    """
+    if os.path.getsize(path) > MMAP_BYTES:
+        return np.load(path, mmap_mode='r')
+    return np.load(path)
+
+
+def load_products(cache_dir, path, directions, settings=None):
+    """
+    Returns the cached products of a fits-file or None if there is no up-to-date entry.
+
+    :param cache_dir: The cache directory
+    :param path: The path of the fits-file
+    :param directions: The directions from given sources
+    :param settings: The settings the products depend on
+    :return: products: The arrays and figures of the entry
+    """
+    entry = entry_prefix(cache_dir, path) + '.' + cache_key(path, directions, settings)[:16]
+    if not os.path.isfile(entry + '.json'):
+        return None
+    try:
+        with open(entry + '.json') as inputfile:
+            figures = json.load(inputfile)['figures']
+        arrays = {name[:-len('.npy')]: load_array(os.path.join(entry, name))
+                  for name in os.listdir(entry) if name.endswith('.npy')}
+    except (OSError, ValueError, KeyError):
+        return None
+    figures = {key: pio.from_json(value) for key, value in figures.items()}
+    return arrays, figures
+
+
+def save_products(cache_dir, path, directions, arrays, figures, settings=None):
+    """
+    Saves the products of a fits-file as a directory of npy-files (arrays and scalars) and a json-file (figures) and
+    removes stale entries of the same file. The npy-files are uncompressed so they can be memory-mapped.
+
+    :param cache_dir: The cache directory
+    :param path: The path of the fits-file
+    :param directions: The directions from given sources
+    :param arrays: The arrays and scalars to store
+    :param figures: The figures to store
+    :param settings: The settings the products depend on
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = entry_prefix(cache_dir, path)
+    key = cache_key(path, directions, settings)
+    entry = prefix + '.' + key[:16]
+
+    for stale in glob.glob(prefix + '.*'):
+        if stale != entry and not stale.startswith(entry + '.'):
+            remove_entry(stale)
+
+    # the json-file is written last and marks the entry as complete, temporary names are unique per process as
+    # several server processes may build the same entry at once
+    temporary = entry + '.tmp' + str(os.getpid())
+    os.makedirs(temporary)
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, name + '.npy'), array)
+    try:
+        os.replace(temporary, entry)
+    except OSError:
+        # the arrays were saved by another process or are left over from an incomplete entry
+        if os.path.isfile(entry + '.json'):
+            remove_entry(temporary)
+            return
+        remove_entry(entry)
+        os.replace(temporary, entry)
+    meta = {'path': os.path.abspath(path), 'key': key, 'settings': settings,
+            'directions': [[float(ra), float(dec)] for ra, dec in directions],
+            'figures': {name: figure.to_json() for name, figure in figures.items()}}
+    with open(temporary + '.json', 'w') as outputfile:
+        json.dump(meta, outputfile)
+    os.replace(temporary + '.json', entry + '.json')
+
+
+@contextlib.contextmanager
+def build_lock(cache_dir, name, wait=False):
+    """
+    Returns a context holding an exclusive lock on building the given run in the cache directory and yields whether
+    the lock was acquired. Processes finding the lock taken skip the build, or wait for it to finish and then load the
+    products from the cache. The lock is released when its process ends, it is not taken on systems without fcntl.
+
+    :param cache_dir: The cache directory
+    :param name: The folder name of the run
+    :param wait: Boolean initialized with False, waits for the lock instead of skipping the build
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield True
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, name + LOCK_SUFFIX), 'w') as lockfile:
+        try:
+            fcntl.flock(lockfile, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        yield True
+
+
+def load_manifest(cache_dir):
+    """
+    Returns the list of precomputed runs of a cache directory.
+
+    :param cache_dir: The cache directory
+    :return: manifest: The file signature and settings of each precomputed run by folder name (empty if there is none)
+    """
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_FILE)) as inputfile:
+            return json.load(inputfile)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_manifest(cache_dir, manifest):
+    """
+    Saves the list of precomputed runs of a cache directory. The file is replaced at once, so running dashboards
+    never read a partial list.
+
+    :param cache_dir: The cache directory
+    :param manifest: The file signature and settings of each precomputed run by folder name
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = os.path.join(cache_dir, MANIFEST_FILE + '.tmp' + str(os.getpid()))
+    with open(temporary, 'w') as outputfile:
+        json.dump(manifest, outputfile, indent=1, sort_keys=True)
+    os.replace(temporary, os.path.join(cache_dir, MANIFEST_FILE))
+
+
+def remove_entry(path):
+    """
+    Removes a file or directory of a cache entry if it exists.
+
+    :param path: The path of the file or directory
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
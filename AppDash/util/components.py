@@ -2,6 +2,10 @@
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
+from dash import dash_table
+
+from util import metrics
+from util import photometry
 
 
 #########################
@@ -15,14 +19,12 @@ def dropdown_card(models):
     :param models: The data model with the CASA images
     :return: Card: The card for the dropdown
     """
-    options = []
-    for key in models:
-        options.append({'label': key, 'value': key})
+    options = dropdown_options(models)
 
     dropdown = dcc.Dropdown(
         id='dropdown',
         options=options,
-        value=options[0]['value'],
+        value=options[0]['value'] if options else None,
         style={'width': '620px', 'height': '40px', 'fontSize': '12pt'}
     )
     return dbc.Card(
@@ -39,16 +41,29 @@ def dropdown_card(models):
     )
 
 
+def dropdown_options(models):
+    """
+    Returns the dropdown options of all output folders.
+
+    :param models: The data model with the CASA images
+    :return: options: The label and value of each output folder
+    """
+    options = []
+    for key in models:
+        options.append({'label': key, 'value': key})
+    return options
+
+
 #########################
 # Card for Observation
 #########################
 
-def observing_card(img_sky, img_psf):
+def observing_card(img_sky=None, img_psf=None):
     """
     Returns a card with sky-model and the psf-image for analysing.
 
-    :param img_sky: The sky-model image
-    :param img_psf: The psf image
+    :param img_sky: The url of the sky-model image (None until it is rendered)
+    :param img_psf: The url of the psf image (None until it is rendered)
     :return: Card: The card with the sky-model and psf images
     """
     return dbc.Card(
@@ -58,11 +73,11 @@ def observing_card(img_sky, img_psf):
                 dbc.Row(children=[
                     dbc.Col(
                         html.Div([
-                            html.Img(src=img_sky)
+                            html.Img(src=img_sky, id='skymodel-image')
                         ], className="six columns")),
                     dbc.Col(
                         html.Div([
-                            html.Img(src=img_psf)
+                            html.Img(src=img_psf, id='psf-image')
                         ], className="six columns")),
                 ])
             ]), style={"width": "50%"}
@@ -90,38 +105,26 @@ def analyze_card(casa_image):
                         dbc.Row([
                             dbc.Col(
                                 html.Div([
-                                    dcc.Graph(figure=casa_image.image, id=casa_image.name + "-image")
+                                    dcc.Graph(figure=casa_image.image, id={'type': 'image', 'index': casa_image.name})
                                 ], className="six columns"))
                         ]),
                         html.H4('Statistical information', style={'color': colors['text'], 'marginLeft': 70}),
-                        dbc.Row([
-                            dbc.Col(
-                                html.Div([
-                                    dcc.Markdown('maximum pixel value: ' + str(casa_image.stats['max'])),
-                                    dcc.Markdown('minimum pixel value: ' + str(casa_image.stats['min'])),
-                                    dcc.Markdown('mean pixel value: ' + str(casa_image.stats['mean'])),
-                                    dcc.Markdown('median pixel value: ' + str(casa_image.stats['median']))
-                                ], className="six columns", style={'marginLeft': 70})
-                            ),
-                            dbc.Col(
-                                html.Div([
-                                    dcc.Markdown('standard deviation about mean: ' + str(casa_image.stats['sigma'])),
-                                    dcc.Markdown('sum of pixel values: ' + str(casa_image.stats['sum'])),
-                                    dcc.Markdown('size of all pixel values: ' + str(casa_image.stats['size']))
-                                ], className="six columns")
-                            ),
-                        ], className="six columns")
+                        dbc.Row(stats_columns(casa_image), id={'type': 'stats', 'index': casa_image.name},
+                                className="six columns"),
+                        channel_selection(casa_image)
                     ]),
                     # Hists
                     dbc.Col([
                         html.Div([
-                            dcc.Graph(figure=casa_image.hist, id=casa_image.name + "-hist")
+                            dcc.Graph(figure=casa_image.hist, id={'type': 'hist', 'index': casa_image.name})
                         ]),
                         html.Div([
-                            dcc.Graph(figure=casa_image.hist_onsource, id=casa_image.name + 'onsource_hist')
+                            dcc.Graph(figure=casa_image.hist_onsource,
+                                      id={'type': 'onsource_hist', 'index': casa_image.name})
                         ]),
                         html.Div([
-                            dcc.Graph(figure=casa_image.hist_offsource, id=casa_image.name + 'offsource_hist')
+                            dcc.Graph(figure=casa_image.hist_offsource,
+                                      id={'type': 'offsource_hist', 'index': casa_image.name})
                         ])
                     ],
                         className="six columns")
@@ -130,6 +133,140 @@ def analyze_card(casa_image):
     )
 
 
+def loading_card(name):
+    """
+    Returns a placeholder of the analysis card of an image until its data model is built.
+
+    :param name: The name of the image
+    :return: Card: The placeholder card
+    """
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H4('Analysis of ' + name + '-Image', style={'color': colors['text']}),
+                dbc.Spinner(color='primary')
+            ]), id=name + '-card', style={"width": "100%"}
+    )
+
+
+def stats_columns(casa_image):
+    """
+    Returns the columns with the statistical information of a casa image.
+
+    :param casa_image: The given casa image
+    :return: columns: The columns with the statistical information
+    """
+    return [
+        dbc.Col(
+            html.Div([
+                dcc.Markdown('maximum pixel value: ' + str(casa_image.stats['max'])),
+                dcc.Markdown('minimum pixel value: ' + str(casa_image.stats['min'])),
+                dcc.Markdown('mean pixel value: ' + str(casa_image.stats['mean'])),
+                dcc.Markdown('median pixel value: ' + str(casa_image.stats['median']))
+            ], className="six columns", style={'marginLeft': 70})
+        ),
+        dbc.Col(
+            html.Div([
+                dcc.Markdown('standard deviation about mean: ' + str(casa_image.stats['sigma'])),
+                dcc.Markdown('sum of pixel values: ' + str(casa_image.stats['sum'])),
+                dcc.Markdown('size of all pixel values: ' + str(casa_image.stats['size']))
+            ], className="six columns")
+        ),
+    ]
+
+
+def channel_selection(casa_image):
+    """
+    Returns the channel slider and the spectrum of a cube. For a plain image the slider is hidden, as the interaction
+    callbacks expect it on every card.
+
+    :param casa_image: The given casa image
+    :return: Div: The channel slider and the spectrum
+    """
+    last = casa_image.channels - 1
+    slider = dcc.Slider(id={'type': 'channel', 'index': casa_image.name}, min=0, max=last, step=1,
+                        value=casa_image.channel_index, marks={0: '0', last: str(last)},
+                        tooltip={'placement': 'bottom'})
+    if casa_image.channels == 1:
+        return html.Div([slider], style={'display': 'none'})
+    return html.Div([
+        html.H4('Channel', style={'color': colors['text'], 'marginLeft': 70}),
+        html.Div([slider], style={'marginLeft': 70}),
+        dcc.Graph(figure=casa_image.spectrum, id={'type': 'spectrum', 'index': casa_image.name})
+    ])
+
+
+#########################
+# Card for Photometry
+#########################
+
+def photometry_card():
+    """
+    Returns a card with the measurements of all catalog sources of the selected run in a table, which is sorted and
+    paged by the server, and a scatter plot of measured against catalog flux.
+
+    :return: Card: The card with the table and the scatter plot
+    """
+    columns = []
+    for column, label, unit in photometry.COLUMNS:
+        name = label if unit is None else label + ' [' + unit + ']'
+        if column == 'name':
+            columns.append({'name': name, 'id': column})
+        else:
+            columns.append({'name': name, 'id': column, 'type': 'numeric', 'format': {'specifier': '.4~g'}})
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H4('Photometry of Catalog Sources', style={'color': colors['text']}),
+                html.Div(id='photometry-status', style={'margin': '1rem 0'}),
+                dcc.Graph(id='photometry-scatter'),
+                dash_table.DataTable(id='photometry-table', columns=columns, data=[], page_action='custom',
+                                     page_current=0, page_size=20, sort_action='custom', sort_mode='single',
+                                     sort_by=[], style_table={'overflowX': 'auto'})
+            ]), style={"width": "100%"}
+    )
+
+
+#########################
+# Card for Comparison
+#########################
+
+def comparison_card():
+    """
+    Returns a card comparing the metrics of one image over all indexed runs in a sortable table and a scatter plot.
+
+    :return: Card: The card with the table and the scatter plot
+    """
+    columns = [{'name': 'Run', 'id': 'folder'}]
+    columns += [{'name': label, 'id': column, 'type': 'text' if units is None else 'numeric'}
+                for column, label, units in metrics.PARAMETERS]
+    columns += [{'name': label, 'id': column, 'type': 'numeric', 'format': {'specifier': '.4~g'}}
+                for column, label in metrics.METRICS]
+    axes = [{'label': label, 'value': column} for column, label, units in metrics.PARAMETERS if units is not None]
+    axes += [{'label': label, 'value': column} for column, label in metrics.METRICS]
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H4('Comparison of Runs', style={'color': colors['text']}),
+                dbc.Row(children=[
+                    dbc.Col(
+                        dcc.RadioItems(id='compare-image', value='Flat', inline=True,
+                                       options=[{'label': ' ' + name, 'value': name} for name in
+                                                ('Flat', 'Residual', 'Fidelity')],
+                                       inputStyle={'marginLeft': '1rem'}), width=4),
+                    dbc.Col(
+                        dcc.Dropdown(id='compare-x', options=axes, value='rms', clearable=False), width=4),
+                    dbc.Col(
+                        dcc.Dropdown(id='compare-y', options=axes, value='dr', clearable=False), width=4),
+                ]),
+                html.Div(id='compare-status', style={'margin': '1rem 0'}),
+                dcc.Graph(id='compare-scatter'),
+                dash_table.DataTable(id='compare-table', columns=columns, data=[], sort_action='native',
+                                     filter_action='native', page_size=50, style_table={'overflowX': 'auto'})
+            ]), style={"width": "100%"}
+    )
+
+
 #########################
 # Further Templates
 #########################
@@ -1,5 +1,27 @@
-from astropy.io import fits
+import copy
+import dataclasses
+import os
+import threading
+from collections import OrderedDict
+
 from util.helpers import *
+from util import cache
+from util import photometry
+from util import pyramid
+from util import regionstats
+from util import stats
+from util.profiling import profiler
+
+# Attribute, name and file suffix of the analyzed images of a simulation run
+IMAGE_FILES = (('flat', 'Flat', '.image.flat.fits'),
+               ('residual', 'Residual', '.residual.fits'),
+               ('fidelity', 'Fidelity', '.fidelity.fits'))
+
+# Images with more bytes are analyzed in streaming mode
+STREAM_BYTES = 2 ** 30
+
+# Number of channels of a cube whose products are kept in memory
+CHANNEL_IMAGES = 8
 
 
 #########################
@@ -8,10 +30,12 @@ from util.helpers import *
 
 class Datamodel:
     """
-    This class creates the datamodel with loading fits-files and saving png.files
+    This class creates the datamodel with loading fits-files. The skymodel and psf plots are rendered on demand by the
+    plot renderer, the photometry of the catalog sources is measured on demand.
     """
 
-    def __init__(self, path, directions, folder, index):
+    def __init__(self, path, directions, folder, index, cache_dir=None, products=None, mask_settings=None,
+                 stream_bytes=STREAM_BYTES):
         """
         This methods will be called when an object of this class is instantiated. It initializes variables and calls
         methods.
@@ -20,17 +44,52 @@ class Datamodel:
         :param directions: The directions from given sources
         :param folder: The folder name
         :param index: The index of datamodel
+        :param cache_dir: The directory of the derived products cache (None to disable caching)
+        :param products: The derived products of the images by name, e.g. built in a worker process (None to build
+                         or load them)
+        :param mask_settings: The settings of the source mask (None for the default boxes)
+        :param stream_bytes: The size in bytes above which images are analyzed in streaming mode (None for never)
         """
         print('creating datamodel ' + str(index))
-        self.skymodel = fits.open(path + folder + '.skymodel.fits')
-        self.psf = fits.open(path + folder + '.psf.fits')
-        self.flat = casa_image(fits.open(path + folder + '.image.flat.fits'), 'Flat', directions)
-        self.residual = casa_image(fits.open(path + folder + '.residual.fits'), 'Residual', directions)
-        self.fidelity = casa_image(fits.open(path + folder + '.fidelity.fits'), 'Fidelity', directions)
+        self.skymodel = path + folder + '.skymodel.fits'
+        self.psf = path + folder + '.psf.fits'
+        self.sources = os.path.join(os.path.dirname(os.path.dirname(path)), 'sources.pkl')
+        self.cache_dir = cache_dir
+        self.measurements = None
+        self.photometry_lock = threading.Lock()
+        for attribute, name, suffix in IMAGE_FILES:
+            image_products = None if products is None else products.get(name)
+            setattr(self, attribute, casa_image(path + folder + suffix, name, directions, cache_dir, image_products,
+                                                mask_settings, stream_bytes))
 
-        print('creating skymodel and psf plots')
-        save_png_plot(self.skymodel, 'Skymodel')
-        save_png_plot(self.psf, 'Psf')
+    def photometry(self):
+        """
+        Returns the measurements of all sources of the catalog. They are measured the first time they are requested
+        and cached with the catalog, keyed by the fits-files of the flat, residual and fidelity image.
+
+        :return: measurements: The array of each column of photometry.COLUMNS
+        """
+        with self.photometry_lock:
+            if self.measurements is not None:
+                return self.measurements
+            names, directions, fluxes = photometry.load_catalog(self.sources)
+            images = [self.flat, self.residual, self.fidelity]
+            settings = {'photometry': photometry.PHOTOMETRY_VERSION,
+                        'images': [[os.path.abspath(image.path), os.stat(image.path).st_mtime_ns,
+                                    os.stat(image.path).st_size] for image in images]}
+            products = None
+            if self.cache_dir is not None:
+                products = cache.load_products(self.cache_dir, self.sources, directions, settings)
+            if products is None:
+                print('---- measuring %d sources' % len(names))
+                with profiler.stage('photometry'):
+                    measurements = photometry.measure_sources(*images, names, directions, fluxes)
+                if self.cache_dir is not None:
+                    cache.save_products(self.cache_dir, self.sources, directions, measurements, dict(), settings)
+            else:
+                measurements = products[0]
+            self.measurements = measurements
+            return measurements
 
 
 #########################
@@ -42,40 +101,221 @@ class casa_image:
     This class creates a CASA image object and plots it with various histograms and statistical information.
     """
 
-    def __init__(self, fits, name, directions):
+    def __init__(self, path, name, directions, cache_dir=None, products=None, mask_settings=None,
+                 stream_bytes=STREAM_BYTES):
         """
         This methods will be called when an object of this class is instantiated. It initializes variables and calls
-        methods.
+        methods. The fits-file is memory-mapped and its pixel data is read once, the file handle is closed afterwards.
+        Derived products are taken from the given products or loaded from the cache if it holds an up-to-date entry of
+        the fits-file; computed products are saved to the cache and loaded back memory-mapped. Images larger than
+        stream_bytes are analyzed in streaming mode: the memory-mapped pixels are only read in blocks of rows, the
+        median is interpolated in a fine histogram and no region index tables are built, zoomed regions are analyzed
+        directly instead. Of a cube, the products of the first channel and the spectrum of all channels are computed
+        here, the products of further channels when they are first viewed.
 
-        :param fits: The fits-file
+        :param path: The path of the fits-file
         :param name: The name of the fits-file
         :param directions: The directions from given sources
+        :param cache_dir: The directory of the derived products cache (None to disable caching)
+        :param products: The derived products as returned by products() (None to load or compute them)
+        :param mask_settings: The settings of the source mask (None for the default boxes)
+        :param stream_bytes: The size in bytes above which the image is analyzed in streaming mode (None for never)
         """
+        from astropy.io import fits
+
         print('-- initializing ' + name)
         self.name = name
-        self.fits = fits
-        self.data = get_FITS_data(fits)
+        self.path = path
+        self.directions = directions
+        self.mask_settings = mask_settings
 
+        with profiler.stage('fits open'):
+            hdulist = fits.open(path, memmap=True)
+        with hdulist:
+            self.header = hdulist[0].header
+            with profiler.stage('data extraction'):
+                self.cube = get_FITS_cube(hdulist)
+            self.data = self.cube[0]
+            self.channels = len(self.cube)
+            self.channel_index = 0
+            self.channel_images = OrderedDict()
+            self.channel_lock = threading.Lock()
+            self.streaming = stream_bytes is not None and self.data.nbytes > stream_bytes
+            settings = {'mask': mask_settings, 'streaming': self.streaming}
+            if products is None and cache_dir is not None:
+                with profiler.stage('cache load'):
+                    products = cache.load_products(cache_dir, path, directions, settings)
+            if products is None:
+                self.compute()
+                self.compute_spectrum()
+                if cache_dir is not None:
+                    with profiler.stage('cache save'):
+                        cache.save_products(cache_dir, path, directions, *self.products(), settings)
+                    # the computed arrays are replaced by the memory-mapped copies just saved, so this process shares
+                    # them with all other processes loading the entry instead of keeping a private copy
+                    with profiler.stage('cache load'):
+                        products = cache.load_products(cache_dir, path, directions, settings)
+                    if products is not None:
+                        self.restore(*products)
+            else:
+                print('---- loading cached products')
+                self.restore(*products)
+
+    def compute(self):
+        """
+        Computes masks, image, histograms and statistical information from the image data.
+        """
         print('---- creating masks')
-        self.data_onsource = create_masked_data(fits, directions, invert=True)
-        self.data_offsource = create_masked_data(fits, directions)
+        with profiler.stage('masking'):
+            self.source_mask = create_source_mask(self.header, self.data.shape, self.directions, self.mask_settings)
+
+        print('---- creating image pyramid')
+        with profiler.stage('image pyramid'):
+            self.pyramid = pyramid.build_pyramid(self.data, streaming=self.streaming)
+        with profiler.stage('image figure'):
+            self.image = pyramid.create_view(self.pyramid, self.name + '-Image')
+
+        print('---- calculating statistics' + (' in streaming mode' if self.streaming else ''))
+        with profiler.stage('stats'):
+            self.records = {'data': stats.fused_stats(self.data, exact=not self.streaming),
+                            'onsource': stats.fused_stats(self.data, self.source_mask, median=False),
+                            'offsource': stats.fused_stats(self.data, self.source_mask, invert=True, median=False)}
+        self.apply_records()
+
+        if self.streaming:
+            self.index = regionstats.StreamingIndex(self.data, self.hist_bins['edges'])
+        else:
+            print('---- creating region index')
+            with profiler.stage('region index'):
+                self.index = regionstats.RegionIndex(self.data, self.hist_bins['edges'])
+
+    def compute_spectrum(self):
+        """
+        Computes RMS and peak of all channels of a cube in one vectorized pass.
+        """
+        if self.channels == 1:
+            self.spectrum_rms = self.spectrum_peak = self.spectrum = None
+            return
+        print('---- calculating spectrum of %d channels' % self.channels)
+        with profiler.stage('spectrum'):
+            self.spectrum_rms, self.spectrum_peak = stats.channel_spectrum(self.cube)
+        self.apply_spectrum()
 
-        print('---- creating image')
-        self.image = create_image(self.data, name + '-Image')
+    def apply_spectrum(self):
+        """
+        Sets the spectrum figure from RMS and peak of all channels.
+        """
+        values, label = channel_axis(self.header, self.channels)
+        self.spectrum = spectrum_figure(values, label, self.spectrum_rms, self.spectrum_peak, self.name + ' Spectrum')
+
+    def channel(self, index):
+        """
+        Returns the casa image of one channel of a cube. Its masks, image, histograms and statistical information are
+        computed when the channel is first requested and kept for the most recently viewed channels.
+
+        :param index: The index of the channel
+        :return: image: The casa image of the channel
+        """
+        index = min(max(int(index), 0), self.channels - 1)
+        if index == self.channel_index:
+            return self
+        with self.channel_lock:
+            if index in self.channel_images:
+                self.channel_images.move_to_end(index)
+                return self.channel_images[index]
+
+        print('-- initializing ' + self.name + ' channel ' + str(index))
+        image = copy.copy(self)
+        image.data = self.cube[index]
+        image.channel_index = index
+        image.channel_images = None
+        image.channel_lock = None
+        image.compute()
+        with self.channel_lock:
+            self.channel_images[index] = image
+            while len(self.channel_images) > CHANNEL_IMAGES:
+                self.channel_images.popitem(last=False)
+        return image
+
+    def apply_records(self):
+        """
+        Sets histogram bins, histogram figures, RMS, DR and statistical information from the stats records of the
+        whole image, the on-source and the off-source pixels.
+        """
+        self.hist_bins = self.records['data'].bins()
+        self.hist_onsource_bins = self.records['onsource'].bins()
+        self.hist_offsource_bins = self.records['offsource'].bins()
+        with profiler.stage('histogram'):
+            self.hist = hist_figure(self.hist_bins, self.name + ' Distribution')
+            self.hist_onsource = hist_figure(self.hist_onsource_bins, 'Onsource Distribution')
+            self.hist_offsource = hist_figure(self.hist_offsource_bins, 'Offsource Distribution')
+
+        self.rms = self.records['data'].rms
+        self.rms_onsource = self.records['onsource'].rms
+        self.rms_offsource = self.records['offsource'].rms
+        self.dr = self.records['data'].dr
+        self.dr_onsource = self.records['onsource'].dr
+        self.dr_offsource = self.records['offsource'].dr
 
-        print('---- creating histograms')
-        self.hist = create_hist(self.data, name + ' Distribution')
-        self.hist_onsource = create_hist(self.data_onsource, 'Onsource Distribution')
-        self.hist_offsource = create_hist(self.data_offsource, 'Offsource Distribution')
+        self.stats = self.records['data'].stats()
 
-        print('---- calculating RMS and DR')
-        self.rms = calculate_RMS(self.data)
-        self.rms_onsource = calculate_RMS(self.data_onsource)
-        self.rms_offsource = calculate_RMS(self.data_offsource)
-        self.dr = calculate_DR(self.data, self.rms)
-        self.dr_onsource = calculate_DR(self.data_onsource, self.rms_onsource)
-        self.dr_offsource = calculate_DR(self.data_offsource, self.rms_offsource)
+    def products(self):
+        """
+        Returns the derived products for the cache or a parent process. Scalars are kept as zero-dimensional arrays to
+        preserve their type and precision.
+
+        :return: arrays: The bit-packed mask, pyramid levels, tile statistics, stats records and
+                         spectrum
+        :return: figures: The figures (none are stored, all are rebuilt from the arrays)
+        """
+        arrays = {'source_mask': self.source_mask}
+        if self.channels > 1:
+            arrays.update({'spectrum_rms': self.spectrum_rms, 'spectrum_peak': self.spectrum_peak})
+        if not self.streaming:
+            arrays.update({'tile_counts': self.index.tile_counts, 'tile_max': self.index.tile_max,
+                           'tile_sums': self.index.tile_sums, 'tile_squares': self.index.tile_squares})
+        for level, data in enumerate(self.pyramid[1:], 1):
+            if data is not None:
+                arrays['pyramid_' + str(level)] = data
+        for region, record in self.records.items():
+            for field in dataclasses.fields(record):
+                arrays['record_' + region + '_' + field.name] = getattr(record, field.name)
+        return {key: np.asarray(value) for key, value in arrays.items()}, dict()
+
+    def restore(self, arrays, figures):
+        """
+        Restores the derived products from the cache. Arrays loaded from the cache are memory-mapped read-only, so all
+        processes serving the same run share one copy of them.
+
+        :param arrays: The mask, pyramid levels, tile statistics, stats records and spectrum
+        :param figures: The figures
+        """
+        self.spectrum_rms = arrays.get('spectrum_rms')
+        self.spectrum_peak = arrays.get('spectrum_peak')
+        self.spectrum = None
+        if self.channels > 1:
+            self.apply_spectrum()
 
-        self.stats = stats_dict(self.data)
+        with profiler.stage('masking'):
+            self.source_mask = create_source_mask(self.header, self.data.shape, self.directions, self.mask_settings,
+                                                  arrays['source_mask'])
+        levels = [int(key[len('pyramid_'):]) for key in arrays if key.startswith('pyramid_')]
+        self.pyramid = [self.data] + [None] * max(levels, default=0)
+        for level in levels:
+            self.pyramid[level] = arrays['pyramid_' + str(level)]
+        with profiler.stage('image figure'):
+            self.image = pyramid.create_view(self.pyramid, self.name + '-Image')
 
+        self.records = dict()
+        for region in ('data', 'onsource', 'offsource'):
+            values = {field.name: arrays['record_' + region + '_' + field.name][()]
+                      for field in dataclasses.fields(stats.StatsRecord)}
+            self.records[region] = stats.StatsRecord(**values)
+        self.apply_records()
 
+        if self.streaming:
+            self.index = regionstats.StreamingIndex(self.data, self.hist_bins['edges'])
+            return
+        self.index = regionstats.RegionIndex(self.data, self.hist_bins['edges'],
+                                             (arrays['tile_counts'], arrays['tile_max'], arrays['tile_sums'],
+                                              arrays['tile_squares']))
@@ -1,50 +1,203 @@
-from matplotlib import pyplot as plt
-from astropy.wcs import WCS
+import base64
+import hashlib
+import io
+import json
+import weakref
+
 import numpy as np
-import plotly.express as px
-import pandas as pd
+import plotly.colors
+import plotly.graph_objects as go
+from PIL import Image
+
+from util import stats
+
+# Edge length of the box masked around each source in pixels
+BOX_SIZE = 100
+
+# Number of sources painted at once into a circular mask
+SOURCE_CHUNK = 4096
+
+# Number of rows of a source mask painted at once
+MASK_ROWS = 1024
+
+# Colors of the continuous color scale of the images, evenly spaced
+COLORSCALE = plotly.colors.sequential.Jet
+
+# Source masks in use, shared by all images with the same geometry
+source_masks = weakref.WeakValueDictionary()
 
 
 #########################
 # Helper Functions
 #########################
+def get_FITS_cube(fits):
+    """
+    Returns the fits data from a CASA image as cube of channel planes. Degenerate axes and all but the first Stokes
+    parameter are dropped, a plain image is returned as cube with one channel. If the fits-file was opened with memmap
+    the cube is a view on the file and no copy is made.
+
+    :param fits: The fits-data
+    :return: cube: Data in fits format with the channels along the first axis
+    """
+    data = np.asarray(fits[0].data)
+    header = fits[0].header
+    if data.ndim == 2:
+        return data[np.newaxis]
+    # numpy axes are in the reverse order of the fits axes
+    index = []
+    for axis in range(data.ndim - 2):
+        ctype = str(header.get('CTYPE%d' % (data.ndim - axis), ''))
+        index.append(0 if data.shape[axis] == 1 or ctype.upper().startswith('STOKES') else slice(None))
+    data = data[tuple(index)]
+    return data.reshape((-1,) + data.shape[-2:])
+
+
 def get_FITS_data(fits):
     """
-    Returns the fits data from a CASA image.
+    Returns the fits data from a CASA image, the first channel of a cube. If the fits-file was opened with memmap the
+    data is a view on the file and no copy is made.
 
     :param fits: The fits-data
     :return: data: Data in fits format
     """
-    data = np.array(fits[0].data).squeeze()
-    return data
+    return get_FITS_cube(fits)[0]
+
+
+def channel_axis(header, channels):
+    """
+    Returns the coordinates of the channels of a cube, the frequency in GHz if the cube has a frequency axis.
 
+    :param header: The fits-header
+    :param channels: The number of channels
+    :return: values: The coordinate of each channel
+    :return: label: The label of the coordinate
+    """
+    for axis in range(3, header.get('NAXIS', 0) + 1):
+        if str(header.get('CTYPE%d' % axis, '')).upper().startswith('FREQ') and header['NAXIS%d' % axis] == channels:
+            pixels = np.arange(channels) + 1 - header.get('CRPIX%d' % axis, 1)
+            return (header.get('CRVAL%d' % axis, 0) + pixels * header.get('CDELT%d' % axis, 1)) / 1e9, 'GHz'
+    return np.arange(channels), 'channel'
+
+
+def colormap_lut(colors=COLORSCALE, size=255):
+    """
+    Returns the lookup table of a continuous color scale as RGB values.
+
+    :param colors: The evenly spaced colors of the color scale
+    :param size: The number of entries
+    :return: lut: The RGB value of each entry
+    """
+    rgb = np.array([plotly.colors.unlabel_rgb(color) for color in colors])
+    positions = np.linspace(0, 1, len(colors))
+    samples = np.linspace(0, 1, size)
+    return np.rint([np.interp(samples, positions, rgb[:, channel]) for channel in range(3)]).T.astype('u1')
+
+
+def encode_png(data, zmin, zmax, lut):
+    """
+    Returns the data colored with the lookup table as base64-encoded palette PNG. The data is quantized to the entries
+    of the lookup table, NaN pixels get the transparent entry after the last color.
 
-def create_image(data, title):
+    :param data: The data for the image
+    :param zmin: The value of the first color
+    :param zmax: The value of the last color
+    :param lut: The RGB value of each color (at most 255)
+    :return: source: The PNG as data url
     """
-    Returns an image as a figure.
+    finite = ~np.isnan(data)
+    scale = (len(lut) - 1) / (zmax - zmin) if zmax > zmin else 0.0
+    index = np.full(data.shape, len(lut), dtype='u1')
+    index[finite] = np.clip(np.rint((data[finite] - zmin) * scale), 0, len(lut) - 1)
+    png = Image.fromarray(index, 'P')
+    png.putpalette(np.vstack([lut, [[0, 0, 0]]]).ravel().tolist())
+    buffer = io.BytesIO()
+    png.save(buffer, format='png', transparency=len(lut))
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def create_image(data, title, x=None, y=None):
+    """
+    Returns an image as a figure. The pixels are sent as PNG colored on the server, only the color bar is drawn from
+    a separate invisible trace, so the payload does not grow with the value precision.
 
     :param data: The data for the image
     :param title: The title of the image
+    :param x: The column coordinates of the data, evenly spaced (None for pixel indices)
+    :param y: The row coordinates of the data, evenly spaced (None for pixel indices)
     :return: image: The image as a figure
     """
-    labels = {'color': 'Jy/beam'}
-    image = px.imshow(data, color_continuous_scale="jet", origin='lower', labels=labels, width=800, height=800,
-                      title=title)
+    ny, nx = data.shape
+    x = np.arange(nx) if x is None else x
+    y = np.arange(ny) if y is None else y
+    finite = data[~np.isnan(data)]
+    zmin, zmax = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+
+    image = go.Figure(go.Image(source=encode_png(data, zmin, zmax, colormap_lut()), x0=x[0],
+                               dx=x[1] - x[0] if nx > 1 else 1, y0=y[0], dy=y[1] - y[0] if ny > 1 else 1,
+                               hoverinfo='x+y'))
+    colorbar = go.Scatter(x=[None], y=[None], mode='markers', hoverinfo='skip', showlegend=False,
+                          marker={'colorscale': [[position, color] for position, color in
+                                                 zip(np.linspace(0, 1, len(COLORSCALE)), COLORSCALE)],
+                                  'cmin': zmin, 'cmax': zmax, 'color': [zmin], 'showscale': True,
+                                  'colorbar': {'title': {'text': 'Jy/beam'}}})
+    image.add_trace(colorbar)
+    image.update_layout(title=title, width=800, height=800)
+    image.update_xaxes(constrain='domain', scaleanchor='y')
+    image.update_yaxes(autorange=True, constrain='domain')
     return image
 
 
-def create_hist(data, title):
+def relayout_region(relayoutData, shape):
     """
-    Returns a histogram of given data (pandas DataFrame).
+    Returns the zoomed region of an image figure from its relayout data in pixel indices.
 
-    :param data: The data for the histogram
+    :param relayoutData: The re-layouted data
+    :param shape: The shape of the image data
+    :return: region: The region (x0, x1, y0, y1) or None if the image is not zoomed
+    """
+    if relayoutData is None:
+        return None
+    if 'xaxis.range[0]' not in relayoutData and 'yaxis.range[0]' not in relayoutData:
+        return None
+    ny, nx = shape
+    x0 = int(round(relayoutData.get('xaxis.range[0]', 0)))
+    x1 = int(round(relayoutData.get('xaxis.range[1]', nx)))
+    y0 = int(round(relayoutData.get('yaxis.range[0]', 0)))
+    y1 = int(round(relayoutData.get('yaxis.range[1]', ny)))
+    return min(max(x0, 0), nx), min(max(x1, 0), nx), min(max(y0, 0), ny), min(max(y1, 0), ny)
+
+
+def zoom_key(relayoutData):
+    """
+    Returns a key of the zoomed region of relayout data, with the axis ranges rounded to whole pixels like the region.
+
+    :param relayoutData: The re-layouted data
+    :return: key: The key of the region
+    """
+    if relayoutData is None:
+        return None
+    if 'xaxis.autorange' in relayoutData:
+        return 'autorange'
+    return tuple(None if relayoutData.get(name) is None else int(round(relayoutData[name]))
+                 for name in ('xaxis.range[0]', 'xaxis.range[1]', 'yaxis.range[0]', 'yaxis.range[1]'))
+
+
+def hist_figure(bins, title):
+    """
+    Returns a histogram figure of precomputed bins. Only the counts are sent to the browser, the bins are given by the
+    position and width of the first bin.
+
+    :param bins: The bin counts and edges with the RMS and maximum
     :param title: The title of the histogram
     :return: hist: The histogram as a figure
     """
-    df = pd.DataFrame(data=data.flatten().astype('f8'), columns=['Jy/beam']).dropna()
-    hist = px.histogram(df, nbins=128, x='Jy/beam', title=title, height=350)
-    rms = calculate_RMS(data)
-    dr = calculate_DR(data, rms)
+    edges = bins['edges']
+    width = float(edges[1] - edges[0])
+    hist = go.Figure(go.Bar(x0=float(edges[0]) + width / 2, dx=width, y=bins['counts'], width=width,
+                            marker_line_width=0))
+    hist.update_layout(title=title, height=350, bargap=0, xaxis_title='Jy/beam', yaxis_title='count')
+    rms = bins['rms']
+    dr = (bins['max'] / rms).round(4)
 
     hist.add_annotation(
         x=0.95,
@@ -73,115 +226,239 @@ def create_hist(data, title):
     return hist
 
 
-def save_png_plot(fits, title):
+def create_hist(data, title):
     """
-    Plots fits image of given image data and saves it as png-file.
+    Returns a histogram of given data with bins computed on the server.
 
-    :param fits: The data of the image
-    :param title: Title of the image
+    :param data: The data for the histogram
+    :param title: The title of the histogram
+    :return: hist: The histogram as a figure
     """
-    fig = plt.figure(figsize=(8, 4))
-    ax = fig.add_subplot(111)
-
-    img = ax.imshow(get_FITS_data(fits), cmap='jet', origin='lower')
-    ax.set_title(title, fontsize=14)
-    cmap = plt.colorbar(img, ax=ax)
+    return hist_figure(stats.fused_stats(data, median=False).bins(), title)
 
-    plt.savefig('assets/' + title + '.png', bbox_inches="tight")
 
-
-def calculate_pixcoord(fits, direction):
+def spectrum_figure(values, label, rms, peak, title):
     """
-    Returns calculated pixel coordinates as a list. Transforms world coordinates to pixel coordinates with the given
-    directions right ascension and declination.
-
-    :param fits: The fits-data
-    :param direction: The given direction as a list
-    :return: pixel_coords: Calculated pixel coordinates
+    Returns a figure of the RMS and the peak of all channels of a cube.
+
+    :param values: The coordinate of each channel
+    :param label: The label of the coordinate
+    :param rms: The RMS of each channel
+    :param peak: The peak of each channel
+    :param title: The title of the figure
+    :return: spectrum: The spectrum as a figure
     """
-    wcs = WCS(fits[0].header, fix=False)
-
-    ra_deg = direction[0]
-    dec_deg = direction[1]
+    spectrum = go.Figure()
+    spectrum.add_trace(go.Scatter(x=values, y=rms, mode='lines', name='RMS'))
+    spectrum.add_trace(go.Scatter(x=values, y=peak, mode='lines', name='Peak'))
+    spectrum.update_layout(title=title, height=350, xaxis_title=label, yaxis_title='Jy/beam')
+    return spectrum
 
-    coordinates = np.array(wcs.wcs_world2pix(ra_deg, dec_deg, 0, ra_dec_order=True))
-    pixel_coords = np.array([coordinates[1], coordinates[0]])
-    return pixel_coords
 
-
-def calculate_mask(data, coordinates, invert=False):
+def photometry_figure(measurements, title):
     """
-    Returns the calculated mask as a list from given image data and coordinates.
+    Returns a scatter plot of the peak and integrated flux measured in the flat image against the catalog flux of all
+    sources, with the line of equal flux.
 
-    :param data: The image data
-    :param coordinates: The calculated coordinates from given directions
-    :param invert: Boolean initialized with False
-    :return: masked_array: The calculated mask
+    :param measurements: The array of each photometry column
+    :param title: The title of the figure
+    :return: scatter: The scatter plot as a figure
     """
-    if invert:
-        mask = np.ones(data.shape, dtype=bool)
-    else:
-        mask = np.zeros(data.shape, dtype=bool)
-
-    for coord in coordinates:
-        mask[int(coord[0]) - 50:int(coord[0]) + 50, int(coord[1]) - 50:int(coord[1]) + 50] = not invert
-
-    masked_array = np.ma.masked_array(data, mask, fill_value=float('NaN'))
-    return masked_array
-
-
-def create_masked_data(fits, directions, invert=False):
+    catalog = measurements['catalog_flux']
+    scatter = go.Figure()
+    for column, name in (('peak_flux', 'Peak flux'), ('integrated_flux', 'Integrated flux')):
+        scatter.add_trace(go.Scattergl(x=catalog, y=measurements[column], mode='markers', name=name,
+                                       text=measurements['name'], marker={'size': 4},
+                                       hovertemplate='%{text}<br>%{x:.4g} Jy, %{y:.4g}<extra></extra>'))
+    finite = catalog[np.isfinite(catalog)]
+    if finite.size:
+        scatter.add_trace(go.Scatter(x=[finite.min(), finite.max()], y=[finite.min(), finite.max()], mode='lines',
+                                     name='Catalog flux', line={'dash': 'dash', 'color': 'gray'}))
+    scatter.update_layout(title=title, height=500, xaxis_title='Catalog flux [Jy]',
+                          yaxis_title='Measured flux [Jy/beam, Jy]')
+    return scatter
+
+
+def comparison_figure(rows, x, y, labels, title):
     """
-    Returns masked data from given fits-file and calculated pixel coordinates.
-
-    :param fits: The fits-data
-    :param directions: The directions from given sources
-    :param invert: Boolean initialized with False
-    :return: masked_data: The masked data
+    Returns a scatter plot of two parameters or metrics of the compared runs, colored by the sky model.
+
+    :param rows: The folder, parameters and metrics of each run
+    :param x: The column of the x-axis
+    :param y: The column of the y-axis
+    :param labels: The label of each column
+    :param title: The title of the figure
+    :return: scatter: The scatter plot as a figure
+    """
+    scatter = go.Figure()
+    for sm in sorted({row['sm'] or '' for row in rows}):
+        group = [row for row in rows if (row['sm'] or '') == sm]
+        scatter.add_trace(go.Scattergl(x=[row[x] for row in group], y=[row[y] for row in group], mode='markers',
+                                       name=sm or 'unknown', text=[row['folder'] for row in group],
+                                       hovertemplate='%{text}<br>%{x}, %{y}<extra></extra>'))
+    scatter.update_layout(title=title, height=500, xaxis_title=labels[x], yaxis_title=labels[y],
+                          legend_title_text=labels['sm'])
+    return scatter
+
+
+def calculate_pixcoords(wcs, directions):
     """
-    coordinates = []
-    for direction in directions:
-        coordinates.append(calculate_pixcoord(fits, direction))
+    Returns the pixel coordinates (row, column) of all given directions. The world coordinates are transformed in one
+    batched call.
 
-    masked_data = calculate_mask(get_FITS_data(fits), coordinates, invert)
-    return masked_data.filled()
+    :param wcs: The celestial world coordinate system of the image
+    :param directions: The directions (right ascension, declination) from given sources
+    :return: pixel_coords: Calculated pixel coordinates, one row per direction
+    """
+    directions = np.asarray(directions, dtype='f8').reshape(-1, 2)
+    columns, rows = wcs.wcs_world2pix(directions[:, 0], directions[:, 1], 0, ra_dec_order=True)
+    return np.column_stack([rows, columns])
 
 
-def calculate_RMS(data):
+def paint_boxes(shape, coordinates, box=BOX_SIZE):
+    """
+    Returns a bit-packed mask which is True inside square boxes around the given coordinates. The boxes are painted
+    with a two-dimensional difference array, so the cost does not depend on the number or size of the boxes. The
+    difference array is integrated and packed in blocks of rows, only the packed mask spans the whole image.
+
+    :param shape: The shape of the image
+    :param coordinates: The pixel coordinates (row, column) of the box centers
+    :param box: The edge length of the boxes in pixels
+    :return: mask: The mask, packed with np.packbits after flattening
+    """
+    ny, nx = shape
+    centers = np.trunc(coordinates).astype('i8')
+    rows = np.clip(centers[:, 0:1] + [-(box // 2), box - box // 2], 0, ny)
+    columns = np.clip(centers[:, 1:2] + [-(box // 2), box - box // 2], 0, nx)
+    valid = (rows[:, 1] > rows[:, 0]) & (columns[:, 1] > columns[:, 0])
+    rows, columns = rows[valid], columns[valid]
+
+    # corners of the boxes as (row, column, sign)
+    corners = np.concatenate([np.column_stack([rows[:, 0], columns[:, 0], np.ones(len(rows), dtype='i8')]),
+                              np.column_stack([rows[:, 0], columns[:, 1], -np.ones(len(rows), dtype='i8')]),
+                              np.column_stack([rows[:, 1], columns[:, 0], -np.ones(len(rows), dtype='i8')]),
+                              np.column_stack([rows[:, 1], columns[:, 1], np.ones(len(rows), dtype='i8')])])
+    corners = corners[np.argsort(corners[:, 0], kind='stable')]
+    mask = np.empty(-(-ny * nx // 8), dtype='u1')
+    running = np.zeros(nx + 1, dtype='i4')
+    for start in range(0, ny, MASK_ROWS):
+        stop = min(start + MASK_ROWS, ny)
+        low, high = np.searchsorted(corners[:, 0], [start, stop])
+        difference = np.zeros((stop - start, nx + 1), dtype='i4')
+        block = corners[low:high]
+        np.add.at(difference, (block[:, 0] - start, block[:, 1]), block[:, 2])
+        difference[0] += running
+        np.cumsum(difference, axis=0, out=difference)
+        running = difference[-1].copy()
+        np.cumsum(difference, axis=1, out=difference)
+        # blocks start at a multiple of MASK_ROWS rows and thus of 8 pixels
+        mask[start * nx // 8:-(-stop * nx // 8)] = np.packbits(difference[:, :nx] > 0)
+    return mask
+
+
+def paint_disks(shape, coordinates, radius):
+    """
+    Returns a bit-packed mask which is True inside disks around the given coordinates. The mask is painted and packed
+    in blocks of rows like the boxes: all pixel offsets of a disk are added to all centers reaching into the block at
+    once, chunked over the sources.
+
+    :param shape: The shape of the image
+    :param coordinates: The pixel coordinates (row, column) of the disk centers
+    :param radius: The radius of the disks in pixels
+    :return: mask: The mask, packed with np.packbits after flattening
     """
-    Returns the calculated rms (root mean square) from given image data.
+    ny, nx = shape
+    mask = np.empty(-(-ny * nx // 8), dtype='u1')
+    extent = int(np.ceil(radius))
+    dy, dx = np.mgrid[-extent:extent + 1, -extent:extent + 1]
+    inside = dy ** 2 + dx ** 2 <= radius ** 2
+    dy, dx = dy[inside], dx[inside]
+    centers = np.rint(coordinates).astype('i8')
+    centers = centers[np.argsort(centers[:, 0], kind='stable')]
+    for start in range(0, ny, MASK_ROWS):
+        stop = min(start + MASK_ROWS, ny)
+        block = np.zeros((stop - start, nx), dtype=bool)
+        low, high = np.searchsorted(centers[:, 0], [start - extent, stop + extent])
+        for first in range(low, high, SOURCE_CHUNK):
+            chunk = centers[first:min(first + SOURCE_CHUNK, high)]
+            rows = (chunk[:, 0:1] + dy).ravel() - start
+            columns = (chunk[:, 1:2] + dx).ravel()
+            valid = (rows >= 0) & (rows < stop - start) & (columns >= 0) & (columns < nx)
+            block[rows[valid], columns[valid]] = True
+        # blocks start at a multiple of MASK_ROWS rows and thus of 8 pixels
+        mask[start * nx // 8:-(-stop * nx // 8)] = np.packbits(block)
+    return mask
+
+
+def mask_key(wcs, shape, directions, settings):
+    """
+    Returns the key under which a source mask is shared. Images with the same geometry and sources get the same key.
 
-    :param data: The image data
-    :return: rms: The calculated root mean square
+    :param wcs: The celestial world coordinate system of the image
+    :param shape: The shape of the image
+    :param directions: The directions from given sources
+    :param settings: The mask settings
+    :return: key: The hex digest of the key
     """
-    rms = np.sqrt(np.nanmean(np.square(data)))
-    return rms.round(4)
+    # observation metadata (e.g. date, observatory location) does not change the pixel transform
+    projection = wcs.wcs
+    geometry = [list(projection.ctype), projection.crval.tolist(), projection.crpix.tolist(),
+                projection.cdelt.tolist(), projection.get_pc().tolist(), projection.lonpole, projection.latpole,
+                [list(pv) for pv in projection.get_pv()], projection.radesys, projection.equinox]
+    key = [geometry, list(shape), [[float(ra), float(dec)] for ra, dec in directions], settings]
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
 
 
-def calculate_DR(data, rms):
+def share_mask(key, mask):
     """
-    Returns the calculated dr (dynamic range) from given data and rms.
+    Returns the source mask in use under the given key, or registers the given mask under it.
 
-    :param data: The image data
-    :param rms: The calculated root mean square
-    :return: dr: The calculated dynamic range
+    :param key: The key of the mask
+    :param mask: The mask
+    :return: mask: The shared mask
     """
-    dr = np.nanmax(data) / rms
-    return dr.round(4)
+    shared = source_masks.get(key)
+    if shared is None:
+        mask.flags.writeable = False
+        source_masks[key] = mask
+        shared = mask
+    return shared
 
 
-def stats_dict(data):
+def create_source_mask(header, shape, directions, settings=None, mask=None):
     """
-    Returns the statistical information from given image data.
+    Returns a mask which is True around the given directions, bit-packed with np.packbits after flattening, so it
+    takes one bit per pixel. Masks are shared by all images with the same world coordinate system and shape, e.g.
+    flat, residual and fidelity image of a run.
 
-    :param data: The image data
-    :return: stat: The statistical information
+    :param header: The fits-header of the image
+    :param shape: The shape of the image data
+    :param directions: The directions from given sources
+    :param settings: The mask settings, {'box': edge length in pixels} or {'radius': radius in beams}
+    :param mask: A precomputed mask to share, e.g. loaded from the cache (None to compute it)
+    :return: mask: The source mask
     """
-    stats = {'size': np.size(data),
-             'max': np.nanmax(data).round(3),
-             'min': np.nanmin(data).round(3),
-             'mean': np.mean(data).round(3),
-             'median': np.median(data).round(3),
-             'sigma': np.std(data).round(3),
-             'sum': np.sum(data).round(3)}
-    return stats
\ No newline at end of file
+    from astropy.wcs import WCS
+    from astropy.wcs.utils import proj_plane_pixel_scales
+
+    settings = settings or {'box': BOX_SIZE}
+    wcs = WCS(header, fix=False).celestial
+    key = mask_key(wcs, shape, directions, settings)
+    # the mask may be collected between two lookups of the weak dictionary, so it is looked up once
+    shared = source_masks.get(key)
+    if shared is not None:
+        return shared
+    if mask is not None:
+        return share_mask(key, mask)
+
+    coordinates = calculate_pixcoords(wcs, directions)
+    if 'radius' in settings and 'BMAJ' not in header:
+        print('cannot mask disks of %s beams without BMAJ in the header, masking boxes of %d pixels instead'
+              % (settings['radius'], settings.get('box', BOX_SIZE)))
+    if 'radius' in settings and 'BMAJ' in header:
+        # the pixel scale of the declination axis, also for headers with a CD matrix instead of CDELT
+        radius = settings['radius'] * header['BMAJ'] / proj_plane_pixel_scales(wcs)[1]
+        mask = paint_disks(shape, coordinates, radius)
+    else:
+        mask = paint_boxes(shape, coordinates, settings.get('box', BOX_SIZE))
+    return share_mask(key, mask)
@@ -0,0 +1,190 @@
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from util import datamodel
+
+# File name of the metrics index in the cache directory
+METRICS_FILE = 'metrics.sqlite'
+
+# Column, label and unit factors of the parameters parsed from the folder names
+PARAMETERS = (('f', 'f [GHz]', {'Hz': 1e-9, 'kHz': 1e-6, 'MHz': 1e-3, 'GHz': 1.0}),
+              ('df', 'df [MHz]', {'Hz': 1e-6, 'kHz': 1e-3, 'MHz': 1.0, 'GHz': 1e3}),
+              ('dt', 'dt [s]', {'s': 1.0, 'min': 60.0, 'h': 3600.0}),
+              ('sm', 'sm', None))
+
+# Column and label of the metrics of an image, read from the cached stats records
+METRICS = (('rms', 'RMS'), ('dr', 'DR'), ('rms_onsource', 'RMS on'), ('dr_onsource', 'DR on'),
+           ('rms_offsource', 'RMS off'), ('dr_offsource', 'DR off'), ('size', 'Size'), ('max', 'Max'),
+           ('min', 'Min'), ('mean', 'Mean'), ('median', 'Median'), ('sigma', 'Sigma'), ('sum', 'Sum'))
+
+# Region of the stats record and field of each metric
+METRIC_FIELDS = {'rms': ('data', 'rms'), 'dr': ('data', 'dr'), 'rms_onsource': ('onsource', 'rms'),
+                 'dr_onsource': ('onsource', 'dr'), 'rms_offsource': ('offsource', 'rms'),
+                 'dr_offsource': ('offsource', 'dr'), 'size': ('data', 'size'), 'max': ('data', 'max'),
+                 'min': ('data', 'min'), 'mean': ('data', 'mean'), 'median': ('data', 'median'),
+                 'sigma': ('data', 'sigma'), 'sum': ('data', 'sum')}
+
+
+#########################
+# Metrics Helpers
+#########################
+
+def parse_parameters(folder):
+    """
+    Returns the simulation parameters (f, df, dt and sm) encoded in a folder name, e.g.
+    vla_c-single-sim-f_1.0GHz-df_1.0MHz-dt_1s-sm_custom. Frequencies and times are converted to the unit of their
+    column, the first value of a parameter is used.
+
+    :param folder: The folder name
+    :return: parameters: The value of each parameter (None if it is missing or cannot be parsed)
+    """
+    values = dict()
+    for part in folder.split('-'):
+        key, separator, value = part.partition('_')
+        if separator:
+            values.setdefault(key, value)
+    parameters = dict()
+    for column, _, units in PARAMETERS:
+        value = values.get(column) or None
+        if units is not None and value is not None:
+            match = re.fullmatch(r'([0-9.eE+-]+)\s*([a-zA-Z]+)', value)
+            if match is not None and match.group(2) in units:
+                value = float(match.group(1)) * units[match.group(2)]
+            else:
+                value = None
+        parameters[column] = value
+    return parameters
+
+
+def image_of_path(path):
+    """
+    Returns the run folder and the image name of the fits-file of an analyzed image.
+
+    :param path: The path of the fits-file
+    :return: folder: The folder name (None if the file is not an analyzed image)
+    :return: name: The image name
+    """
+    base = os.path.basename(path)
+    for _, name, suffix in datamodel.IMAGE_FILES:
+        if base.endswith(suffix):
+            return base[:-len(suffix)], name
+    return None, None
+
+
+def entry_metrics(entry):
+    """
+    Returns the metrics of an image from the stats records of its cache entry. Only the scalar npy-files are read.
+
+    :param entry: The path of the cache entry directory
+    :return: metrics: The value of each metric
+    """
+    metrics = dict()
+    for column, (region, field) in METRIC_FIELDS.items():
+        value = np.load(os.path.join(entry, 'record_' + region + '_' + field + '.npy'))[()]
+        metrics[column] = None if np.isnan(value) else value.item()
+    return metrics
+
+
+#########################
+# Metrics Index Object
+#########################
+
+class MetricsIndex:
+    """
+    This class keeps the metrics of all cached images with the parameters of their runs in a SQLite database, so runs
+    can be compared without loading data models or fits-files.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        This methods will be called when an object of this class is instantiated. The database is created if it does
+        not exist, it is filled by update().
+
+        :param cache_dir: The directory of the derived products cache
+        """
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, METRICS_FILE)
+        os.makedirs(cache_dir, exist_ok=True)
+        columns = ', '.join(column + (' TEXT' if units is None else ' REAL') for column, _, units in PARAMETERS)
+        metrics = ', '.join(column + ' REAL' for column, _ in METRICS)
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS metrics (folder TEXT, image TEXT, entry TEXT, '
+                               'mtime INTEGER, ' + columns + ', ' + metrics + ', PRIMARY KEY (folder, image))')
+
+    def connect(self):
+        """
+        Returns a new connection to the database. Every request thread and server process uses its own connection.
+
+        :return: connection: The connection
+        """
+        return sqlite3.connect(self.path, timeout=30)
+
+    def update(self):
+        """
+        Adds the metrics of new and rebuilt cache entries and removes those of entries that no longer exist. Entries
+        are recognized by their json-file, which is written last, so unchanged entries are skipped after one stat.
+
+        :return: updated: The number of added or replaced images
+        :return: removed: The number of removed images
+        """
+        start_time = time.time()
+        with self.connect() as connection:
+            indexed = {(folder, image): (entry, mtime) for folder, image, entry, mtime in
+                       connection.execute('SELECT folder, image, entry, mtime FROM metrics')}
+
+        found = dict()
+        rows = []
+        with os.scandir(self.cache_dir) as entries:
+            for item in entries:
+                if not item.name.endswith('.json'):
+                    continue
+                entry = item.path[:-len('.json')]
+                try:
+                    mtime = item.stat().st_mtime_ns
+                    # entries are named after the fits-file, a rebuilt entry replaces the previous one
+                    folder, name = image_of_path(os.path.basename(entry).rsplit('.', 2)[0])
+                    if folder is None:
+                        continue
+                    found[(folder, name)] = (entry, mtime)
+                    if indexed.get((folder, name)) == (entry, mtime):
+                        continue
+                    row = {'folder': folder, 'image': name, 'entry': entry, 'mtime': mtime}
+                    row.update(parse_parameters(folder))
+                    row.update(entry_metrics(entry))
+                except (OSError, ValueError):
+                    # the entry is being written or removed
+                    continue
+                rows.append(row)
+
+        removed = [key for key in indexed if key not in found]
+        if rows or removed:
+            with self.connect() as connection:
+                for row in rows:
+                    connection.execute('INSERT OR REPLACE INTO metrics (' + ', '.join(row) + ') VALUES (' +
+                                       ', '.join('?' * len(row)) + ')', list(row.values()))
+                connection.executemany('DELETE FROM metrics WHERE folder = ? AND image = ?', removed)
+            print("Time to update metrics of %d images:" % len(rows))
+            print("--- %s seconds ---" % (time.time() - start_time))
+        return len(rows), len(removed)
+
+    def query(self, image, folders=None):
+        """
+        Returns the parameters and metrics of one image of all indexed runs.
+
+        :param image: The image name (Flat, Residual or Fidelity)
+        :param folders: The folder names of the runs to return (None for all indexed runs)
+        :return: rows: The folder, parameters and metrics of each run, sorted by folder name
+        """
+        columns = ['folder'] + [column for column, _, _ in PARAMETERS] + [column for column, _ in METRICS]
+        with self.connect() as connection:
+            result = connection.execute('SELECT ' + ', '.join(columns) + ' FROM metrics WHERE image = ? '
+                                        'ORDER BY folder', (image,)).fetchall()
+        rows = [dict(zip(columns, values)) for values in result]
+        if folders is not None:
+            folders = set(folders)
+            rows = [row for row in rows if row['folder'] in folders]
+        return rows
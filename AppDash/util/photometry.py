@@ -0,0 +1,220 @@
+import pickle
+
+import numpy as np
+
+from util.helpers import calculate_pixcoords
+
+# Bump when the measurements change so cached photometry is recomputed
+PHOTOMETRY_VERSION = 2
+
+# Half-width in pixels of the aperture if the image has no beam
+APERTURE_PIXELS = 5
+
+# Half-width of the box of the local RMS in units of the aperture half-width
+RMS_SCALE = 3
+
+# Maximal number of pixels of the cutouts gathered at once
+CUTOUT_PIXELS = 2 ** 22
+
+# Column, label and unit of the measurements of each source
+COLUMNS = (('name', 'Source', None), ('ra', 'RA', 'deg'), ('dec', 'Dec', 'deg'), ('x', 'x', 'pixel'),
+           ('y', 'y', 'pixel'), ('catalog_flux', 'Catalog flux', 'Jy'), ('peak_flux', 'Peak flux', 'Jy/beam'),
+           ('integrated_flux', 'Integrated flux', 'Jy'), ('local_rms', 'Local RMS', 'Jy/beam'), ('snr', 'SNR', None),
+           ('peak_ratio', 'Peak / catalog', None), ('integrated_ratio', 'Integrated / catalog', None),
+           ('fidelity', 'Mean fidelity', None))
+
+
+#########################
+# Photometry Helpers
+#########################
+
+def load_catalog(path):
+    """
+    Returns names, directions and fluxes of the sources of a sources.pkl file.
+
+    :param path: The path of the sources.pkl file
+    :return: names: The name of each source
+    :return: directions: The direction (right ascension, declination) of each source in degrees
+    :return: fluxes: The catalog flux of each source in Jy (NaN if it is missing)
+    """
+    with open(path, "rb") as inputfile:
+        sources = pickle.load(inputfile)
+    names = np.array([str(source.get('Name', index + 1)) for index, source in enumerate(sources)], dtype='U')
+    directions = np.array([(source['sp_direction_ra'], source['sp_direction_dec']) for source in sources],
+                          dtype='f8').reshape(-1, 2)
+    fluxes = np.array([source.get('sp_flux', np.nan) for source in sources], dtype='f8')
+    return names, directions, fluxes
+
+
+def beam_geometry(header):
+    """
+    Returns the aperture half-width and the beam area in pixels. The aperture reaches one beam major axis (FWHM) from
+    the source, which holds nearly all flux of a point source.
+
+    :param header: The fits-header of the image
+    :return: half: The half-width of the aperture box in pixels
+    :return: beam_pixels: The area of the beam in pixels (1 if the image has no beam, fluxes stay in Jy/beam)
+    """
+    from astropy.wcs import WCS
+    from astropy.wcs.utils import proj_plane_pixel_scales
+
+    if 'BMAJ' not in header or 'BMIN' not in header:
+        print('no BMAJ and BMIN in the header, measuring in boxes of %d pixels with integrated fluxes in Jy/beam'
+              % (2 * APERTURE_PIXELS + 1))
+        return APERTURE_PIXELS, 1.0
+    # the pixel scale of the declination axis, also for headers with a CD matrix instead of CDELT
+    scale = proj_plane_pixel_scales(WCS(header, fix=False).celestial)[1]
+    major, minor = header['BMAJ'] / scale, header['BMIN'] / scale
+    # rounded first, so a beam of a whole number of pixels is not widened by the rounding error of the scale
+    return max(int(np.ceil(np.round(major, 6))), 1), np.pi / (4 * np.log(2)) * major * minor
+
+
+def gather_cutouts(data, rows, columns, half):
+    """
+    Returns the square cutouts around the given pixels in one fancy-indexing operation, in the precision of the
+    data. Pixels outside the image are NaN.
+
+    :param data: The image data
+    :param rows: The row of each center
+    :param columns: The column of each center
+    :param half: The half-width of the cutouts
+    :return: cutouts: The cutouts, one per center
+    """
+    ny, nx = data.shape
+    offsets = np.arange(-half, half + 1)
+    cutout_rows = rows[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+    cutout_columns = columns[:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+    inside = (cutout_rows >= 0) & (cutout_rows < ny) & (cutout_columns >= 0) & (cutout_columns < nx)
+    cutouts = data[np.clip(cutout_rows, 0, ny - 1), np.clip(cutout_columns, 0, nx - 1)]
+    cutouts = cutouts.astype(np.result_type(cutouts.dtype, np.float32), copy=False)
+    cutouts[~inside] = np.nan
+    return cutouts
+
+
+def chunks(count, half):
+    """
+    Returns the slices of sources whose cutouts of the given half-width are gathered at once.
+
+    :param count: The number of sources
+    :param half: The half-width of the cutouts
+    :return: slices: The slices of sources
+    """
+    step = max(CUTOUT_PIXELS // (2 * half + 1) ** 2, 1)
+    return [slice(start, start + step) for start in range(0, count, step)]
+
+
+def box_peaks(data, rows, columns, half):
+    """
+    Returns the maximum of the square box around each given pixel.
+
+    :param data: The image data
+    :param rows: The row of each center
+    :param columns: The column of each center
+    :param half: The half-width of the boxes
+    :return: peaks: The maximum of each box (NaN if it holds no finite pixel)
+    """
+    peaks = np.full(len(rows), np.nan)
+    for part in chunks(len(rows), half):
+        cutouts = gather_cutouts(data, rows[part], columns[part], half)
+        cutouts = np.where(np.isnan(cutouts), -np.inf, cutouts).reshape(len(cutouts), -1)
+        maxima = cutouts.max(axis=1) if cutouts.size else np.empty(0)
+        peaks[part] = np.where(np.isfinite(maxima), maxima, np.nan)
+    return peaks
+
+
+def box_sums(data, rows, columns, half):
+    """
+    Returns sum, sum of squares and count of the finite pixels of the square box around each given pixel.
+
+    :param data: The image data
+    :param rows: The row of each center
+    :param columns: The column of each center
+    :param half: The half-width of the boxes
+    :return: sums: The sum of each box
+    :return: squares: The sum of squares of each box
+    :return: counts: The number of finite pixels of each box
+    """
+    sums, squares, counts = np.zeros(len(rows)), np.zeros(len(rows)), np.zeros(len(rows), dtype='i8')
+    for part in chunks(len(rows), half):
+        cutouts = gather_cutouts(data, rows[part], columns[part], half).reshape(len(rows[part]), -1)
+        finite = ~np.isnan(cutouts)
+        values = np.where(finite, cutouts, 0)
+        sums[part] = values.sum(axis=1, dtype='f8')
+        squares[part] = np.einsum('ij,ij->i', values, values, dtype='f8')
+        counts[part] = np.count_nonzero(finite, axis=1)
+    return sums, squares, counts
+
+
+#########################
+# Photometry Functions
+#########################
+
+def measure_sources(flat, residual, fidelity, names, directions, fluxes):
+    """
+    Returns the measurements of all catalog sources, vectorized over the sources: peak flux in a box of half a beam
+    major axis and integrated flux in the aperture box of the flat image, local RMS in a box of RMS_SCALE apertures of
+    the residual image and mean fidelity in the aperture box.
+
+    :param flat: The casa image of the flat image
+    :param residual: The casa image of the residual image
+    :param fidelity: The casa image of the fidelity image
+    :param names: The name of each source
+    :param directions: The direction (right ascension, declination) of each source in degrees
+    :param fluxes: The catalog flux of each source in Jy
+    :return: measurements: The array of each column of COLUMNS
+    """
+    from astropy.wcs import WCS
+
+    half, beam_pixels = beam_geometry(flat.header)
+    if len(directions):
+        pixels = calculate_pixcoords(WCS(flat.header, fix=False).celestial, directions)
+    else:
+        pixels = np.empty((0, 2))
+    # sources without valid coordinates are moved far outside, so all their boxes are empty
+    pixels = np.where(np.isfinite(pixels), pixels, -10 * (RMS_SCALE * half + max(flat.data.shape)))
+    rows, columns = np.rint(pixels).astype('i8').T
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        peaks = box_peaks(flat.data, rows, columns, max(half // 2, 1))
+        sums, _, counts = box_sums(flat.data, rows, columns, half)
+        integrated = np.where(counts > 0, sums / beam_pixels, np.nan)
+        _, squares, counts = box_sums(residual.data, rows, columns, RMS_SCALE * half)
+        rms = np.sqrt(squares / counts)
+        sums, _, counts = box_sums(fidelity.data, rows, columns, half)
+        mean_fidelity = sums / counts
+        return {'name': names, 'ra': directions[:, 0], 'dec': directions[:, 1], 'x': pixels[:, 1],
+                'y': pixels[:, 0], 'catalog_flux': fluxes, 'peak_flux': peaks, 'integrated_flux': integrated,
+                'local_rms': rms, 'snr': peaks / rms, 'peak_ratio': peaks / fluxes,
+                'integrated_ratio': integrated / fluxes, 'fidelity': mean_fidelity}
+
+
+def sorted_page(measurements, sort_by, page, page_size):
+    """
+    Returns one page of the sources as table rows, sorted by one column. NaN values are sorted last.
+
+    :param measurements: The array of each column
+    :param sort_by: The sorted column and direction as given by the table ([] for the catalog order)
+    :param page: The page number
+    :param page_size: The number of rows per page
+    :return: rows: The rows of the page
+    :return: pages: The number of pages
+    """
+    count = len(measurements['name'])
+    order = np.arange(count)
+    if sort_by:
+        values = measurements[sort_by[0]['column_id']]
+        descending = sort_by[0]['direction'] == 'desc'
+        if values.dtype.kind == 'f':
+            missing = np.isnan(values)
+            order = np.lexsort(((-values if descending else values), missing))
+        else:
+            order = np.argsort(values, kind='stable')[::-1 if descending else 1]
+    order = order[page * page_size:(page + 1) * page_size]
+    rows = []
+    for index in order:
+        row = dict()
+        for column, _, _ in COLUMNS:
+            value = measurements[column][index].item()
+            row[column] = None if isinstance(value, float) and np.isnan(value) else value
+        rows.append(row)
+    return rows, max(-(-count // page_size), 1)
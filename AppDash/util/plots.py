@@ -0,0 +1,146 @@
+import glob
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from util import cache
+from util import pyramid
+from util.helpers import get_FITS_data
+from util.profiling import profiler
+
+# Attribute, title and file suffix of the static plots of a simulation run
+PLOT_FILES = (('skymodel', 'Skymodel', '.skymodel.fits'),
+              ('psf', 'Psf', '.psf.fits'))
+
+# Number of threads rendering plots
+RENDER_WORKERS = 2
+
+
+#########################
+# Plot Functions
+#########################
+
+def plot_name(folder, path, title):
+    """
+    Returns the file name of the plot of a fits-file. The name holds the run, the title and a hash of the fits-file
+    (path, modification time and size), so a plot is up-to-date if a file of this name exists.
+
+    :param folder: The folder name of the run
+    :param path: The path of the fits-file
+    :param title: The title of the plot
+    :return: name: The file name of the png-file
+    """
+    return folder + '.' + title + '.' + cache.cache_key(path, [], {'plot': title})[:16] + '.png'
+
+
+def render_png(path, title, output):
+    """
+    Plots the fits image of the given file and saves it as png-file. The figure is created with the object-oriented
+    matplotlib interface on its own Agg canvas, so it is not registered with pyplot, is safe to render in a thread and
+    is freed as soon as it is saved. Images larger than the viewer are downsampled first.
+
+    :param path: The path of the fits-file
+    :param title: Title of the image
+    :param output: The path of the png-file
+    """
+    from astropy.io import fits
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    with fits.open(path, memmap=True) as hdulist:
+        data = get_FITS_data(hdulist)
+        ny, nx = data.shape
+        data = pyramid.build_pyramid(data, streaming=True)[-1]
+
+    fig = Figure(figsize=(8, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    img = ax.imshow(data, cmap='jet', origin='lower', extent=(-0.5, nx - 0.5, -0.5, ny - 0.5))
+    ax.set_title(title, fontsize=14)
+    fig.colorbar(img, ax=ax)
+
+    # several threads or server processes may render the same plot at once
+    temporary = output + '.tmp' + str(os.getpid()) + '.' + str(threading.get_ident())
+    fig.savefig(temporary, bbox_inches="tight", format='png')
+    fig.clear()
+    os.replace(temporary, output)
+
+
+#########################
+# Plot Renderer Object
+#########################
+
+class PlotRenderer:
+    """
+    This class renders the static plots (skymodel and psf) of the simulation runs on demand in a thread pool and keeps
+    them as png-files in the assets folder.
+    """
+
+    def __init__(self, output_dir, workers=RENDER_WORKERS):
+        """
+        This methods will be called when an object of this class is instantiated. No plot is rendered here.
+
+        :param output_dir: The directory of the png-files
+        :param workers: The number of rendering threads
+        """
+        self.output_dir = output_dir
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='PlotRenderer')
+        self.pending = dict()
+        self.lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def render(self, folder, path, title):
+        """
+        Returns a future of the file name of the plot of a fits-file. The plot is only rendered if there is no
+        up-to-date png-file and it is not already being rendered.
+
+        :param folder: The folder name of the run
+        :param path: The path of the fits-file
+        :param title: The title of the plot
+        :return: future: The future of the file name of the png-file
+        """
+        name = plot_name(folder, path, title)
+        with self.lock:
+            if name in self.pending:
+                return self.pending[name]
+            if os.path.isfile(os.path.join(self.output_dir, name)):
+                future = Future()
+                future.set_result(name)
+                return future
+            future = self.executor.submit(self.render_plot, folder, path, title, name)
+            self.pending[name] = future
+            return future
+
+    def render_plot(self, folder, path, title, name):
+        """
+        Renders a plot and removes the outdated plots of the same run and title.
+
+        :param folder: The folder name of the run
+        :param path: The path of the fits-file
+        :param title: The title of the plot
+        :param name: The file name of the png-file
+        :return: name: The file name of the png-file
+        """
+        try:
+            with profiler.run(folder), profiler.stage('png render'):
+                render_png(path, title, os.path.join(self.output_dir, name))
+            for stale in glob.glob(os.path.join(self.output_dir, glob.escape(folder + '.' + title) + '.*.png')):
+                if os.path.basename(stale) != name:
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+        finally:
+            with self.lock:
+                del self.pending[name]
+        return name
+
+    def render_run(self, folder, path):
+        """
+        Returns the futures of the file names of all static plots of a run.
+
+        :param folder: The folder name of the run
+        :param path: The path of the fits-files including the folder name as file prefix
+        :return: futures: The futures by attribute (skymodel and psf)
+        """
+        return {attribute: self.render(folder, path + suffix, title) for attribute, title, suffix in PLOT_FILES}
@@ -0,0 +1,218 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+
+# Number of most recent samples kept per run and stage or per callback
+SAMPLES = 1000
+
+
+#########################
+# Memory Helpers
+#########################
+
+def process_memory():
+    """
+    Returns the resident and the shared memory of this process. Shared memory holds the pages of memory-mapped files,
+    e.g. the fits-files and cached products, which all server processes map only once.
+
+    :return: rss: The resident memory in bytes
+    :return: shared: The shared part of the resident memory in bytes (None if unknown)
+    """
+    try:
+        with open('/proc/self/statm') as inputfile:
+            _, resident, shared = inputfile.read().split()[:3]
+        page = os.sysconf('SC_PAGE_SIZE')
+        return int(resident) * page, int(shared) * page
+    except (OSError, ValueError):
+        # ru_maxrss is the peak resident memory in KB (bytes on macOS)
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024, None
+
+
+def summarize(samples):
+    """
+    Returns the number, total, mean, percentiles and maximum of the durations of the given samples with their largest
+    memory growth and peak. Callbacks prevented from updating are counted separately from errors.
+
+    :param samples: The samples
+    :return: summary: The summary
+    """
+    seconds = np.array([sample['seconds'] for sample in samples])
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+    peaks = [sample['traced_peak_bytes'] for sample in samples if sample['traced_peak_bytes'] is not None]
+    return {'count': len(samples), 'errors': sum(sample['error'] is not None for sample in samples),
+            'prevented': sum(sample.get('prevented', False) for sample in samples),
+            'total': float(seconds.sum()), 'mean': float(seconds.mean()), 'p50': float(p50), 'p95': float(p95),
+            'p99': float(p99), 'max': float(seconds.max()),
+            'rss_delta_max_bytes': max(sample['rss_delta_bytes'] for sample in samples),
+            'traced_peak_max_bytes': max(peaks) if peaks else None}
+
+
+#########################
+# Profiler Object
+#########################
+
+class Profiler:
+    """
+    This class measures the duration and memory of the stages of building the data models and of the Dash callbacks
+    and aggregates them per run and stage and per callback. Every sample holds the growth of the resident memory and,
+    while tracemalloc is tracing (--trace-memory), the peak of the traced memory during the stage.
+    """
+
+    def __init__(self, log_path=None):
+        """
+        This methods will be called when an object of this class is instantiated. It only initializes variables.
+
+        :param log_path: The path of the json-lines log of all samples (None for no log)
+        """
+        self.lock = threading.Lock()
+        self.log_path = log_path
+        self.started = time.time()
+        self.stages = dict()
+        self.callbacks = dict()
+        self.local = threading.local()
+
+    def configure(self, log_path):
+        """
+        Sets the path of the json-lines log of all samples.
+
+        :param log_path: The path of the log (None for no log)
+        """
+        self.log_path = log_path
+
+    @contextlib.contextmanager
+    def run(self, folder):
+        """
+        Returns a context in which the stages of this thread are counted for the given run.
+
+        :param folder: The folder name of the run
+        """
+        previous = getattr(self.local, 'run', None)
+        self.local.run = folder
+        try:
+            yield
+        finally:
+            self.local.run = previous
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Returns a context measuring a stage of the current run. The sample is yielded and filled when the stage ends.
+        Peaks of nested stages are passed on to the enclosing stage, peaks of stages running in other threads at the
+        same time are included.
+
+        :param name: The name of the stage
+        """
+        sample = {'kind': 'stage', 'run': getattr(self.local, 'run', None), 'name': name}
+        try:
+            with self.measure(sample):
+                yield sample
+        finally:
+            self.record(sample)
+
+    def callback(self, function):
+        """
+        Returns the given Dash callback wrapped in a measurement. Raised exceptions are counted as errors and passed on,
+        except PreventUpdate, which is counted as prevented update.
+
+        :param function: The callback
+        :return: wrapper: The measured callback
+        """
+        # dash is only imported by the dashboard, not by the data models
+        from dash.exceptions import PreventUpdate
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            sample = {'kind': 'callback', 'run': None, 'name': function.__name__, 'prevented': False}
+            try:
+                with self.measure(sample):
+                    try:
+                        return function(*args, **kwargs)
+                    except PreventUpdate:
+                        sample['prevented'] = True
+                        raise
+            finally:
+                self.record(sample)
+        return wrapper
+
+    @contextlib.contextmanager
+    def measure(self, sample):
+        """
+        Returns a context filling the given sample with duration, error, resident memory and traced peak memory. A
+        prevented update is not an error.
+
+        :param sample: The sample
+        """
+        parents = self.local.__dict__.setdefault('peaks', [])
+        traced_before = None
+        if tracemalloc.is_tracing():
+            traced_before, peak = tracemalloc.get_traced_memory()
+            if parents:
+                parents[-1] = max(parents[-1], peak)
+            tracemalloc.reset_peak()
+        parents.append(0)
+        rss_before = process_memory()[0]
+        start_time = time.perf_counter()
+        sample['error'] = None
+        try:
+            yield
+        except BaseException as error:
+            if not sample.get('prevented'):
+                sample['error'] = type(error).__name__
+            raise
+        finally:
+            sample['seconds'] = time.perf_counter() - start_time
+            sample['rss_bytes'] = process_memory()[0]
+            sample['rss_delta_bytes'] = sample['rss_bytes'] - rss_before
+            sample['traced_peak_bytes'] = None
+            peak = parents.pop()
+            if traced_before is not None and tracemalloc.is_tracing():
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                sample['traced_peak_bytes'] = peak - traced_before
+                if parents:
+                    parents[-1] = max(parents[-1], peak)
+                tracemalloc.reset_peak()
+
+    def record(self, sample):
+        """
+        Adds a sample to the samples of its run and stage or of its callback and writes it to the log.
+
+        :param sample: The sample
+        """
+        sample['time'] = time.time()
+        sample['pid'] = os.getpid()
+        with self.lock:
+            group = self.callbacks if sample['kind'] == 'callback' else self.stages.setdefault(sample['run'] or '',
+                                                                                               dict())
+            group.setdefault(sample['name'], deque(maxlen=SAMPLES)).append(sample)
+            if self.log_path is not None:
+                with open(self.log_path, 'a') as outputfile:
+                    outputfile.write(json.dumps(sample) + '\n')
+
+    def summary(self):
+        """
+        Returns the summaries of the samples per run and stage and per callback of this process.
+
+        :return: summary: The summaries
+        """
+        with self.lock:
+            stages = {run: {name: list(samples) for name, samples in names.items()}
+                      for run, names in self.stages.items()}
+            callbacks = {name: list(samples) for name, samples in self.callbacks.items()}
+        return {'pid': os.getpid(), 'since': self.started, 'samples': SAMPLES,
+                'runs': {run: {name: summarize(samples) for name, samples in names.items()}
+                         for run, names in stages.items()},
+                'callbacks': {name: summarize(samples) for name, samples in callbacks.items()}}
+
+
+# Profiler of this process, shared by the data models, the plot renderer and the callbacks
+profiler = Profiler()
@@ -0,0 +1,146 @@
+import warnings
+
+import numpy as np
+
+from util.helpers import create_image
+
+# Edge length of the image viewer in pixels
+VIEWPORT = 800
+
+# Number of rows pooled at once, an even number
+POOL_ROWS = 1024
+
+
+#########################
+# Pyramid Functions
+#########################
+
+def pool_block(block, pooling='mean', factor=2):
+    """
+    Returns a block of rows downsampled by the given factor with mean or max pooling. Odd edges are padded with NaN.
+
+    :param block: The rows of the image data
+    :param pooling: The pooling method ('mean' or 'max')
+    :param factor: The downsampling factor
+    :return: pooled: The downsampled rows
+    """
+    ny, nx = block.shape
+    padded = np.full((-(-ny // factor) * factor, -(-nx // factor) * factor), np.nan, dtype='f4')
+    padded[:ny, :nx] = block
+    blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor)
+    with warnings.catch_warnings():
+        # blocks with NaN only stay NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if pooling == 'max':
+            return np.nanmax(blocks, axis=(1, 3))
+        return np.nanmean(blocks, axis=(1, 3))
+
+
+def pool(data, pooling='mean', rows=POOL_ROWS, factor=2):
+    """
+    Returns the data downsampled by the given factor with mean or max pooling. Odd edges are padded with NaN. The data
+    is pooled in blocks of rows, so a memory-mapped image is read block by block and no padded copy of the whole image
+    is made.
+
+    :param data: The image data
+    :param pooling: The pooling method ('mean' or 'max')
+    :param rows: The number of rows pooled at once, rounded up to a multiple of the factor
+    :param factor: The downsampling factor
+    :return: pooled: The downsampled data
+    """
+    ny, nx = data.shape
+    rows = -(-rows // factor) * factor
+    pooled = np.empty((-(-ny // factor), -(-nx // factor)), dtype='f4')
+    for start in range(0, ny, rows):
+        pooled[start // factor:(start + rows) // factor] = pool_block(data[start:start + rows], pooling, factor)
+    return pooled
+
+
+def build_pyramid(data, pooling='mean', size=VIEWPORT, streaming=False):
+    """
+    Returns the levels of a downsampled pyramid. Level 0 is the data itself, each further level halves the resolution
+    until the whole image fits into the viewer. In streaming mode only the coarsest level is pooled, straight from the
+    data in one pass; the levels in between are None and their views are pooled from level 0 when they are requested.
+
+    :param data: The image data
+    :param pooling: The pooling method ('mean' or 'max')
+    :param size: The edge length of the coarsest level
+    :param streaming: Boolean initialized with False, only the coarsest level is kept
+    :return: levels: The pyramid levels
+    """
+    if streaming:
+        level = 0
+        while -(-max(data.shape) // 2 ** level) > size:
+            level += 1
+        if level == 0:
+            return [data]
+        return [data] + [None] * (level - 1) + [pool(data, pooling, factor=2 ** level)]
+    levels = [data]
+    while max(levels[-1].shape) > size:
+        levels.append(pool(levels[-1], pooling))
+    return levels
+
+
+def select_level(levels, width, size=VIEWPORT):
+    """
+    Returns the finest level at which a region of the given width still fits into the viewer.
+
+    :param levels: The pyramid levels
+    :param width: The width of the region in full-resolution pixels
+    :param size: The edge length of the viewer
+    :return: level: The index of the level
+    """
+    level = 0
+    while level + 1 < len(levels) and width / 2 ** level > size:
+        level += 1
+    return level
+
+
+def view_region(levels, x0, x1, y0, y1, size=VIEWPORT):
+    """
+    Returns the visible region at the matching resolution together with its pixel coordinates in full resolution.
+    Levels that are not kept are pooled from the region of level 0.
+
+    :param levels: The pyramid levels
+    :param x0: The first column of the region
+    :param x1: The last column of the region (exclusive)
+    :param y0: The first row of the region
+    :param y1: The last row of the region (exclusive)
+    :param size: The edge length of the viewer
+    :return: region: The data of the region
+    :return: x: The column coordinates
+    :return: y: The row coordinates
+    """
+    level = select_level(levels, max(x1 - x0, y1 - y0), size)
+    scale = 2 ** level
+    ny, nx = levels[0].shape
+    i0, i1 = y0 // scale, min(-(-y1 // scale), -(-ny // scale))
+    j0, j1 = x0 // scale, min(-(-x1 // scale), -(-nx // scale))
+    x = (np.arange(j0, j1) + 0.5) * scale - 0.5
+    y = (np.arange(i0, i1) + 0.5) * scale - 0.5
+    if levels[level] is None:
+        region = levels[0][i0 * scale:i1 * scale, j0 * scale:j1 * scale]
+        return pool(region, factor=scale), x, y
+    return levels[level][i0:i1, j0:j1], x, y
+
+
+def create_view(levels, title, region=None):
+    """
+    Returns an image figure of the whole image or of the given region at the resolution of the viewer.
+
+    :param levels: The pyramid levels
+    :param title: The title of the image
+    :param region: The region (x0, x1, y0, y1) in full-resolution pixels, None for the whole image
+    :return: image: The image as a figure
+    """
+    ny, nx = levels[0].shape
+    if region is None:
+        region = (0, nx, 0, ny)
+    x0, x1, y0, y1 = region
+    data, x, y = view_region(levels, max(x0, 0), min(x1, nx), max(y0, 0), min(y1, ny))
+    image = create_image(data, title, x, y)
+    image.update_layout(uirevision=title)
+    if region != (0, nx, 0, ny):
+        image.update_xaxes(range=[x0 - 0.5, x1 - 0.5])
+        image.update_yaxes(range=[y0 - 0.5, y1 - 0.5])
+    return image
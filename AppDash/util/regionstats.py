@@ -0,0 +1,232 @@
+import numpy as np
+
+# Edge length of the tiles holding precomputed bin counts
+TILE = 64
+
+# Number of rows read at once by the streaming index
+CHUNK_ROWS = 256
+
+
+#########################
+# Index Helpers
+#########################
+
+def count_dtype(size):
+    """
+    Returns the smallest integer type able to count the pixels of an image of the given size.
+
+    :param size: The number of pixels
+    :return: dtype: The integer type
+    """
+    return 'i4' if size < 2 ** 31 else 'i8'
+
+
+def bin_index(values, edges):
+    """
+    Returns the bin of each finite value for the given equally spaced bin edges.
+
+    :param values: The finite values
+    :param edges: The bin edges
+    :return: index: The bin index of each value
+    """
+    nbins = len(edges) - 1
+    width = (edges[-1] - edges[0]) / nbins
+    if width == 0:
+        return np.zeros(values.shape, dtype='i8')
+    index = ((values - edges[0]) / width).astype('i8')
+    return np.clip(index, 0, nbins - 1)
+
+
+def tile_stats(data, edges, tile=TILE):
+    """
+    Returns the cumulative per-tile bin counts, sums and sums of squares and the per-tile maximum of the given data.
+
+    :param data: The image data
+    :param edges: The bin edges
+    :param tile: The edge length of the tiles
+    :return: cumulative: The bin counts of all tiles above and left of tile [i, j]
+    :return: maximum: The maximum of each tile
+    :return: sums: The sum of the non-NaN pixels of all tiles above and left of tile [i, j]
+    :return: squares: The sum of the squared non-NaN pixels of all tiles above and left of tile [i, j]
+    """
+    ny, nx = data.shape
+    nbins = len(edges) - 1
+    ty, tx = -(-ny // tile), -(-nx // tile)
+    cumulative = np.zeros((ty + 1, tx + 1, nbins), dtype=count_dtype(data.size))
+    maximum = np.full((ty, tx), -np.inf, dtype='f4')
+    sums = np.zeros((ty + 1, tx + 1), dtype='f8')
+    squares = np.zeros((ty + 1, tx + 1), dtype='f8')
+    tile_column = np.arange(nx) // tile
+    for row in range(ty):
+        block = data[row * tile:(row + 1) * tile]
+        finite = ~np.isnan(block)
+        keys = np.broadcast_to(tile_column, block.shape)[finite] * nbins + bin_index(block[finite], edges)
+        cumulative[row + 1, 1:] = np.bincount(keys, minlength=tx * nbins).reshape(tx, nbins)
+
+        padded = np.zeros((block.shape[0], tx * tile), dtype=block.dtype)
+        padded[:, :nx] = np.where(finite, block, 0)
+        tiles = padded.reshape(block.shape[0], tx, tile)
+        sums[row + 1, 1:] = tiles.sum(axis=(0, 2), dtype='f8')
+        squares[row + 1, 1:] = np.einsum('ijk,ijk->j', tiles, tiles, dtype='f8')
+        padded[:, :nx] = np.where(finite, block, -np.inf)
+        padded[:, nx:] = -np.inf
+        maximum[row] = tiles.max(axis=(0, 2))
+    for table in (cumulative, sums, squares):
+        np.cumsum(table, axis=0, out=table)
+        np.cumsum(table, axis=1, out=table)
+    return cumulative, maximum, sums, squares
+
+
+def rectangle_sum(table, x0, x1, y0, y1):
+    """
+    Returns the sum over a rectangle of tiles from a cumulative table.
+
+    :param table: The cumulative table
+    :param x0: The first column
+    :param x1: The last column (exclusive)
+    :param y0: The first row
+    :param y1: The last row (exclusive)
+    :return: sum: The sum over the rectangle
+    """
+    return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+
+#########################
+# Region Index Object
+#########################
+
+class RegionIndex:
+    """
+    This class holds cumulative per-tile statistics of an image. RMS, mean, DR and histogram of any rectangular region
+    are answered from the whole tiles inside the region, only the pixels of the border strips are read directly.
+    """
+
+    def __init__(self, data, edges, tiles=None, tile=TILE):
+        """
+        This methods will be called when an object of this class is instantiated. It builds the per-tile statistics if
+        they are not given.
+
+        :param data: The image data
+        :param edges: The histogram bin edges of the whole image
+        :param tiles: The precomputed cumulative tile bin counts, tile maxima, cumulative tile sums and sums of squares
+                      (None to compute them)
+        :param tile: The edge length of the tiles
+        """
+        self.data = data
+        self.edges = edges
+        self.tile = tile
+        if tiles is None:
+            tiles = tile_stats(data, edges, tile)
+        self.tile_counts, self.tile_max, self.tile_sums, self.tile_squares = tiles
+
+    def direct(self, block):
+        """
+        Returns bin counts, maximum, sum and sum of squares of a block of pixels.
+
+        :param block: The pixels
+        :return: counts: The bin counts
+        :return: maximum: The maximum
+        :return: total: The sum
+        :return: squares: The sum of squares
+        """
+        values = block[~np.isnan(block)]
+        if values.size == 0:
+            return 0, -np.inf, 0.0, 0.0
+        return (np.bincount(bin_index(values, self.edges), minlength=len(self.edges) - 1), values.max(),
+                values.sum(dtype='f8'), np.einsum('i,i->', values, values, dtype='f8'))
+
+    def region(self, x0, x1, y0, y1):
+        """
+        Returns the statistics of a rectangular region. Whole tiles inside the region are read from the precomputed
+        tables, only the remaining border pixels are read directly.
+
+        :param x0: The first column
+        :param x1: The last column (exclusive)
+        :param y0: The first row
+        :param y1: The last row (exclusive)
+        :return: bins: The bin counts and edges with RMS, maximum and mean of the region
+        """
+        tile = self.tile
+        tx0, tx1 = -(-x0 // tile), x1 // tile
+        ty0, ty1 = -(-y0 // tile), y1 // tile
+        if tx1 > tx0 and ty1 > ty0:
+            counts = rectangle_sum(self.tile_counts, tx0, tx1, ty0, ty1).astype('i8')
+            maximum = self.tile_max[ty0:ty1, tx0:tx1].max()
+            total = rectangle_sum(self.tile_sums, tx0, tx1, ty0, ty1)
+            squares = rectangle_sum(self.tile_squares, tx0, tx1, ty0, ty1)
+            ix0, ix1, iy0, iy1 = tx0 * tile, tx1 * tile, ty0 * tile, ty1 * tile
+            borders = [self.data[y0:iy0, x0:x1], self.data[iy1:y1, x0:x1],
+                       self.data[iy0:iy1, x0:ix0], self.data[iy0:iy1, ix1:x1]]
+        else:
+            counts = np.zeros(len(self.edges) - 1, dtype='i8')
+            maximum = -np.inf
+            total = squares = 0.0
+            borders = [self.data[y0:y1, x0:x1]]
+        for block in borders:
+            block_counts, block_max, block_total, block_squares = self.direct(block)
+            counts += block_counts
+            maximum = max(maximum, block_max)
+            total += block_total
+            squares += block_squares
+
+        count = counts.sum()
+        if count == 0:
+            return {'counts': counts, 'edges': self.edges, 'rms': np.float64('nan'), 'max': np.float64('nan'),
+                    'mean': np.float64('nan')}
+        rms = np.sqrt(squares / count)
+        return {'counts': counts, 'edges': self.edges, 'rms': rms.round(4), 'max': np.float64(maximum),
+                'mean': np.float64(total / count)}
+
+
+#########################
+# Streaming Index Object
+#########################
+
+class StreamingIndex:
+    """
+    This class answers the statistics of rectangular regions like the region index, but without precomputed tables.
+    The pixels of a region are read in blocks of rows, so images larger than the memory can be analyzed.
+    """
+
+    def __init__(self, data, edges):
+        """
+        This methods will be called when an object of this class is instantiated.
+
+        :param data: The image data, e.g. memory-mapped
+        :param edges: The histogram bin edges of the whole image
+        """
+        self.data = data
+        self.edges = edges
+
+    def region(self, x0, x1, y0, y1):
+        """
+        Returns the statistics of a rectangular region, accumulated over blocks of rows.
+
+        :param x0: The first column
+        :param x1: The last column (exclusive)
+        :param y0: The first row
+        :param y1: The last row (exclusive)
+        :return: bins: The bin counts and edges with RMS, maximum and mean of the region
+        """
+        counts = np.zeros(len(self.edges) - 1, dtype='i8')
+        maximum = -np.inf
+        count = 0
+        total = 0.0
+        squares = 0.0
+        for start in range(y0, y1, CHUNK_ROWS):
+            block = self.data[start:min(start + CHUNK_ROWS, y1), x0:x1]
+            values = block[~np.isnan(block)]
+            if values.size == 0:
+                continue
+            counts += np.bincount(bin_index(values, self.edges), minlength=len(self.edges) - 1)
+            maximum = max(maximum, values.max())
+            count += values.size
+            total += values.sum(dtype='f8')
+            squares += np.einsum('i,i->', values, values, dtype='f8')
+
+        if count == 0:
+            return {'counts': counts, 'edges': self.edges, 'rms': np.float64('nan'), 'max': np.float64('nan'),
+                    'mean': np.float64('nan')}
+        rms = np.sqrt(squares / count)
+        return {'counts': counts, 'edges': self.edges, 'rms': rms.round(4), 'max': np.float64(maximum),
+                'mean': np.float64(total / count)}
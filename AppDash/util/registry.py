@@ -0,0 +1,478 @@
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from util import cache
+from util import datamodel
+from util import photometry
+from util.profiling import profiler
+
+# Maximal number of data models kept in memory by the dashboard unless given otherwise
+MAX_MODELS = 4
+
+#########################
+# Registry Helpers
+#########################
+
+def load_directions(path):
+    """
+    Returns the source directions stored in a sources.pkl file.
+
+    :param path: The path of the sources.pkl file
+    :return: directions: The directions (right ascension, declination) of all sources
+    """
+    with open(path, "rb") as inputfile:
+        sources = pickle.load(inputfile)
+    directions = []
+    for source in sources:
+        directions.append((source['sp_direction_ra'], source['sp_direction_dec']))
+    return directions
+
+
+def is_complete(path, folder):
+    """
+    Returns whether all fits-files needed for a data model exist in the given run folder.
+
+    :param path: The path of the run folder
+    :param folder: The folder name
+    :return: complete: True if all fits-files exist
+    """
+    suffixes = ['.skymodel.fits', '.psf.fits'] + [suffix for _, _, suffix in datamodel.IMAGE_FILES]
+    for suffix in suffixes:
+        if not os.path.isfile(path + "FITS_Files/" + folder + suffix):
+            return False
+    return os.path.isfile(path + "sources.pkl")
+
+
+def run_signature(path, folder):
+    """
+    Returns the modification times and sizes of all files a data model is built from, to detect changed runs.
+
+    :param path: The path of the run folder
+    :param folder: The folder name
+    :return: signature: The modification time and size of each file
+    """
+    suffixes = ['.skymodel.fits', '.psf.fits'] + [suffix for _, _, suffix in datamodel.IMAGE_FILES]
+    paths = [path + "FITS_Files/" + folder + suffix for suffix in suffixes] + [path + "sources.pkl"]
+    signature = []
+    for file_path in paths:
+        stat = os.stat(file_path)
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def manifest_entry(signature, mask_settings, stream_bytes):
+    """
+    Returns the entry of a run in the list of precomputed runs. A run is up-to-date if its entry is unchanged, i.e. its
+    files, the settings of the products and the versions of the cache and the photometry are the same.
+
+    :param signature: The signature of the run files
+    :param mask_settings: The settings of the source mask (None for the default boxes)
+    :param stream_bytes: The size in bytes above which images are analyzed in streaming mode (None for never)
+    :return: entry: The entry as stored in the json-file
+    """
+    entry = {'signature': signature, 'mask': mask_settings, 'stream_bytes': stream_bytes,
+             'cache_version': cache.CACHE_VERSION, 'photometry_version': photometry.PHOTOMETRY_VERSION}
+    return json.loads(json.dumps(entry))
+
+
+def is_memmapped(array):
+    """
+    Returns whether the given array is a view on a memory-mapped file.
+
+    :param array: The array
+    :return: memmapped: True if the memory is backed by a file
+    """
+    base = array
+    while isinstance(base, np.ndarray):
+        base = base.base
+    return isinstance(base, mmap.mmap)
+
+
+def value_nbytes(value, seen=None):
+    """
+    Returns the memory held by the arrays inside the given value. Lists, tuples, dicts and objects of this package are
+    searched recursively, memory-mapped arrays are backed by the fits-files and are not counted. Arrays shared between
+    images (e.g. source masks) are counted once.
+
+    :param value: The value
+    :param seen: The ids of the arrays counted so far
+    :return: nbytes: The number of bytes held by the arrays
+    """
+    seen = set() if seen is None else seen
+    if isinstance(value, np.ndarray):
+        if id(value) in seen or is_memmapped(value):
+            return 0
+        seen.add(id(value))
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(value_nbytes(item, seen) for item in value)
+    if isinstance(value, dict):
+        return sum(value_nbytes(item, seen) for item in value.values())
+    if type(value).__module__.startswith('util.'):
+        return value_nbytes(vars(value), seen)
+    return 0
+
+
+def model_nbytes(model):
+    """
+    Returns the approximate memory held by the arrays of a data model.
+
+    :param model: The data model
+    :return: nbytes: The number of bytes held by the image arrays
+    """
+    return value_nbytes([model.flat, model.residual, model.fidelity])
+
+
+def model_memory(model):
+    """
+    Returns the memory held by the arrays of a data model per image and attribute, e.g. source mask, pyramid and
+    region index. Like model_nbytes, memory-mapped arrays are not counted and shared arrays only at their first image.
+
+    :param model: The data model
+    :return: memory: The number of bytes of each attribute holding arrays by image name
+    """
+    seen = set()
+    memory = dict()
+    for image in (model.flat, model.residual, model.fidelity):
+        attributes = {name: value_nbytes(value, seen) for name, value in vars(image).items()}
+        memory[image.name] = {name: nbytes for name, nbytes in attributes.items() if nbytes}
+    return memory
+
+
+def build_image_products(path, name, directions, cache_dir, mask_settings, stream_bytes):
+    """
+    Builds a casa image and returns its derived products. Runs in a worker process, so only picklable arrays and
+    scalars are returned and no opened fits-file. With a cache no products are returned, the parent process
+    memory-maps them from the cache instead of holding a private copy.
+
+    :param path: The path of the fits-file
+    :param name: The name of the fits-file
+    :param directions: The directions from given sources
+    :param cache_dir: The directory of the derived products cache (None to disable caching)
+    :param mask_settings: The settings of the source mask (None for the default boxes)
+    :param stream_bytes: The size in bytes above which the image is analyzed in streaming mode (None for never)
+    :return: products: The derived products of the image (None if they are cached)
+    :return: seconds: The time needed to build the image
+    """
+    start_time = time.time()
+    image = datamodel.casa_image(path, name, directions, cache_dir, mask_settings=mask_settings,
+                                 stream_bytes=stream_bytes)
+    products = None if cache_dir is not None else image.products()
+    return products, time.time() - start_time
+
+
+#########################
+# Model Registry Object
+#########################
+
+class ModelRegistry:
+    """
+    This class keeps track of all simulation runs in the output folder and builds their data models on demand.
+    """
+
+    def __init__(self, data_path, memory_budget=None, cache_dir=None, trace_memory=False, mask_settings=None,
+                 max_models=None, stream_bytes=datamodel.STREAM_BYTES, precomputed=False):
+        """
+        This methods will be called when an object of this class is instantiated. It only scans the folder names, file
+        signatures and the source metadata, no data model is built here.
+
+        :param data_path: The path of the output folder
+        :param memory_budget: The maximal number of bytes held by built models (None for no limit)
+        :param cache_dir: The directory of the derived products cache (None to disable caching)
+        :param trace_memory: Boolean initialized with False, measures the peak memory of each build with tracemalloc
+        :param mask_settings: The settings of the source mask (None for the default boxes)
+        :param max_models: The maximal number of built models (None for no limit)
+        :param stream_bytes: The size in bytes above which images are analyzed in streaming mode (None for never)
+        :param precomputed: Boolean initialized with False, only lists the runs precomputed into the cache directory
+                            with the same settings by precompute.py
+        """
+        # guards runs and models, which are shared by the request threads and the watcher thread
+        self.lock = threading.RLock()
+        self.data_path = data_path
+        self.memory_budget = memory_budget
+        self.cache_dir = cache_dir
+        self.trace_memory = trace_memory
+        self.mask_settings = mask_settings
+        self.max_models = max_models
+        self.stream_bytes = stream_bytes
+        self.precomputed = precomputed
+        self.runs = OrderedDict()
+        self.signatures = dict()
+        self.incomplete = set()
+        self.models = OrderedDict()
+        self.building = dict()
+        self.sizes = dict()
+        self.build_times = dict()
+        self.peak_memory = dict()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rescans the output folder and updates the runs. Built models of changed and removed runs are dropped, runs that
+        are still being written are skipped until they are complete. If only precomputed runs are listed, runs are
+        skipped until their products are precomputed with the current settings.
+
+        :return: added: The folder names of the new runs
+        :return: changed: The folder names of the changed runs
+        :return: removed: The folder names of the removed runs
+        """
+        found = dict()
+        for folder in sorted(os.listdir(self.data_path)):
+            if not folder.startswith("vla_c"):
+                continue
+            path = self.data_path + folder + "/"
+            try:
+                if not is_complete(path, folder):
+                    raise FileNotFoundError
+                found[folder] = run_signature(path, folder)
+            except OSError:
+                if folder not in self.incomplete:
+                    print('skipping incomplete run ' + folder)
+                    self.incomplete.add(folder)
+
+        if self.precomputed:
+            manifest = cache.load_manifest(self.cache_dir)
+            for folder in list(found):
+                if manifest.get(folder) != manifest_entry(found[folder], self.mask_settings, self.stream_bytes):
+                    if folder not in self.incomplete:
+                        print('skipping run not precomputed ' + folder)
+                        self.incomplete.add(folder)
+                    del found[folder]
+
+        added, changed, removed = [], [], []
+        for folder, signature in found.items():
+            if self.signatures.get(folder) == signature:
+                continue
+            try:
+                directions = load_directions(self.data_path + folder + "/sources.pkl")
+            except (OSError, EOFError, pickle.UnpicklingError):
+                # the source catalog is still being written
+                continue
+            with self.lock:
+                (changed if folder in self.runs else added).append(folder)
+                self.drop(folder)
+                self.runs[folder] = directions
+                self.signatures[folder] = signature
+            self.incomplete.discard(folder)
+
+        with self.lock:
+            for folder in list(self.runs):
+                if folder not in found:
+                    removed.append(folder)
+                    self.drop(folder)
+                    del self.runs[folder]
+                    del self.signatures[folder]
+            if added:
+                self.runs = OrderedDict(sorted(self.runs.items()))
+        return added, changed, removed
+
+    def drop(self, folder):
+        """
+        Drops the built model of the given folder if there is one.
+
+        :param folder: The folder name
+        """
+        with self.lock:
+            if self.models.pop(folder, None) is not None:
+                del self.sizes[folder]
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.runs))
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __contains__(self, folder):
+        return folder in self.runs
+
+    def get(self, folder):
+        """
+        Returns the data model of the given folder and builds it the first time it is requested. A model is built only
+        once if it is requested by several threads at the same time, and with a cache only once by all processes
+        sharing it: the others wait for the build and memory-map its products.
+
+        :param folder: The folder name
+        :return: model: The data model
+        """
+        with self.lock:
+            if folder in self.models:
+                self.models.move_to_end(folder)
+                return self.models[folder]
+            building = self.building.setdefault(folder, threading.Lock())
+
+        # concurrent requests of a model being built wait for it instead of building it again
+        with building:
+            with self.lock:
+                if folder in self.models:
+                    self.models.move_to_end(folder)
+                    return self.models[folder]
+            try:
+                if self.cache_dir is None:
+                    return self.build(folder)
+                with cache.build_lock(self.cache_dir, folder, wait=True):
+                    return self.build(folder)
+            finally:
+                with self.lock:
+                    self.building.pop(folder, None)
+
+    def build(self, folder, products=None):
+        """
+        Builds the data model of the given folder and adds it to the built models.
+
+        :param folder: The folder name
+        :param products: The derived products of the images by name (None to build them)
+        :return: model: The data model
+        """
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+
+        with self.lock:
+            index = list(self.runs).index(folder)
+            directions = self.runs[folder]
+        with profiler.run(folder), profiler.stage('model build') as sample:
+            model = datamodel.Datamodel(self.data_path + folder + "/FITS_Files/", directions, folder, index,
+                                       self.cache_dir, products, self.mask_settings, self.stream_bytes)
+        self.build_times[folder] = sample['seconds']
+        print("Time to build model %s:" % folder)
+        print("--- %s seconds ---" % self.build_times[folder])
+
+        if self.trace_memory:
+            self.peak_memory[folder] = sample['traced_peak_bytes']
+            print("Peak memory to build model %s:" % folder)
+            print("--- %.1f MB ---" % (self.peak_memory[folder] / 1024 ** 2))
+        if tracing:
+            tracemalloc.stop()
+
+        size = model_nbytes(model)
+        print("Memory of model %s:" % folder)
+        print("--- %.1f MB ---" % (size / 1024 ** 2))
+        with self.lock:
+            self.models[folder] = model
+            self.models.move_to_end(folder)
+            self.sizes[folder] = size
+            self.evict()
+        return model
+
+    def warm(self, folder):
+        """
+        Computes the derived products of the given folder into the cache without keeping its model, so its first request
+        only loads them and the models selected by users are not evicted. The model is not built without a cache, if
+        only precomputed runs are listed (their products are in the cache already), if it is already built or while it
+        is built by a request or by another process sharing the cache.
+
+        :param folder: The folder name
+        :return: warmed: True if the products were computed or loaded into the cache
+        """
+        if self.cache_dir is None or self.precomputed:
+            return False
+        with self.lock:
+            if folder in self.models or folder not in self.runs:
+                return False
+            building = self.building.setdefault(folder, threading.Lock())
+        if not building.acquire(blocking=False):
+            return False
+        try:
+            with cache.build_lock(self.cache_dir, folder) as acquired:
+                if not acquired:
+                    return False
+                with self.lock:
+                    index = list(self.runs).index(folder)
+                    directions = self.runs[folder]
+                with profiler.run(folder), profiler.stage('cache warm'):
+                    datamodel.Datamodel(self.data_path + folder + "/FITS_Files/", directions, folder, index,
+                                        self.cache_dir, mask_settings=self.mask_settings,
+                                        stream_bytes=self.stream_bytes)
+            return True
+        finally:
+            with self.lock:
+                self.building.pop(folder, None)
+            building.release()
+
+    def preload(self, workers):
+        """
+        Builds the data models of all runs with the images of all runs built concurrently in a process pool. A model is
+        assembled as soon as its three images are done. With a maximal number of models, only that many runs are
+        preloaded, as further models would evict the first ones.
+
+        :param workers: The number of worker processes
+        """
+        start_time = time.time()
+        folders = [folder for folder in self.runs if folder not in self.models]
+        if self.max_models is not None and len(folders) > self.max_models - len(self.models):
+            folders = folders[:max(self.max_models - len(self.models), 0)]
+            print('preloading only %d of %d runs, at most %d models are kept in memory' %
+                  (len(folders), len(self.runs), self.max_models))
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork') if 'fork' in methods else None
+        image_seconds = 0.0
+        assemble_seconds = 0.0
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            futures = dict()
+            for folder in folders:
+                path = self.data_path + folder + "/FITS_Files/" + folder
+                for _, name, suffix in datamodel.IMAGE_FILES:
+                    future = executor.submit(build_image_products, path + suffix, name, self.runs[folder],
+                                             self.cache_dir, self.mask_settings, self.stream_bytes)
+                    futures[future] = (folder, name)
+
+            products = dict()
+            built = 0
+            for future in as_completed(futures):
+                folder, name = futures[future]
+                image_products, seconds = future.result()
+                image_seconds += seconds
+                products.setdefault(folder, dict())[name] = image_products
+                if len(products[folder]) == len(datamodel.IMAGE_FILES):
+                    assemble_time = time.time()
+                    self.build(folder, products.pop(folder))
+                    assemble_seconds += time.time() - assemble_time
+                    built += 1
+
+        print("Time to build images in worker processes (sum over workers):")
+        print("--- %s seconds ---" % image_seconds)
+        print("Time to assemble models:")
+        print("--- %s seconds ---" % assemble_seconds)
+        print("Time to preload %d models with %d workers:" % (built, workers))
+        print("--- %s seconds ---" % (time.time() - start_time))
+
+    def nbytes(self):
+        """
+        Returns the approximate memory held by all built models.
+
+        :return: nbytes: The number of bytes
+        """
+        with self.lock:
+            return sum(self.sizes.values())
+
+    def over_budget(self):
+        """
+        Returns whether the built models exceed the memory budget or the maximal number of models.
+
+        :return: exceeded: True if a model has to be evicted
+        """
+        if self.max_models is not None and len(self.models) > self.max_models:
+            return True
+        return self.memory_budget is not None and self.nbytes() > self.memory_budget
+
+    def evict(self):
+        """
+        Evicts the least recently used models until the memory budget and the maximal number of models are met. The
+        most recently used model is kept.
+        """
+        with self.lock:
+            while len(self.models) > 1 and self.over_budget():
+                folder, _ = self.models.popitem(last=False)
+                del self.sizes[folder]
+                print('evicting model ' + folder)
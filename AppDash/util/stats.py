@@ -0,0 +1,292 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+# Number of histogram bins
+NBINS = 128
+
+# Number of fine bins used to locate the median, a multiple of NBINS
+MEDIAN_BINS = 512 * NBINS
+
+# Number of pixel values processed at once
+CHUNK_SIZE = 2 ** 22
+
+
+#########################
+# Stats Record Object
+#########################
+
+@dataclass
+class StatsRecord:
+    """
+    This class holds all statistical information of an image region. NaN pixels are ignored, except for size and
+    nan_count.
+    """
+    size: int
+    nan_count: int
+    count: int
+    max: float
+    min: float
+    mean: float
+    median: float
+    sigma: float
+    sum: float
+    rms: float
+    dr: float
+    counts: np.ndarray
+    edges: np.ndarray
+
+    def bins(self):
+        """
+        Returns the histogram bins as used by the histogram figures.
+
+        :return: bins: The bin counts and edges with the RMS and maximum
+        """
+        return {'counts': self.counts, 'edges': self.edges, 'rms': self.rms, 'max': self.max}
+
+    def stats(self):
+        """
+        Returns the statistical information shown on the analysis card. As before, mean, median, sigma and sum are NaN
+        if the region contains NaN pixels.
+
+        :return: stats: The statistical information
+        """
+        nan = np.float64('nan')
+        if self.nan_count:
+            mean = median = sigma = total = nan
+        else:
+            mean, median, sigma, total = self.mean, self.median, self.sigma, self.sum
+        return {'size': self.size,
+                'max': np.round(self.max, 3),
+                'min': np.round(self.min, 3),
+                'mean': np.round(mean, 3),
+                'median': np.round(median, 3),
+                'sigma': np.round(sigma, 3),
+                'sum': np.round(total, 3)}
+
+
+#########################
+# Stats Functions
+#########################
+
+def channel_spectrum(cube):
+    """
+    Returns the RMS and the peak of every channel of a cube in one pass. Blocks of whole channels are reduced at once,
+    so the number of numpy calls does not grow with the number of channels. Channels larger than a chunk are reduced
+    chunk by chunk instead.
+
+    :param cube: The cube with the channels along the first axis
+    :return: rms: The RMS of each channel (NaN for channels without finite pixels)
+    :return: peak: The maximum of each channel (NaN for channels without finite pixels)
+    """
+    channels = len(cube)
+    plane = max(cube[0].size, 1)
+    rms = np.full(channels, np.nan)
+    peak = np.full(channels, np.nan)
+    if plane > CHUNK_SIZE:
+        for channel in range(channels):
+            count, squares, maximum = 0, 0.0, -np.inf
+            for _, values in chunks(cube[channel]):
+                if values.size:
+                    count += values.size
+                    squares += np.einsum('i,i->', values, values, dtype='f8')
+                    maximum = max(maximum, values.max())
+            if count:
+                rms[channel] = np.sqrt(squares / count)
+                peak[channel] = maximum
+        return rms, peak
+    step = CHUNK_SIZE // plane
+    for start in range(0, channels, step):
+        block = cube[start:start + step].reshape(-1, plane)
+        finite = ~np.isnan(block)
+        counts = finite.sum(axis=1)
+        values = np.where(finite, block, 0)
+        squares = np.einsum('ij,ij->i', values, values, dtype='f8')
+        maximum = np.where(finite, block, -np.inf).max(axis=1)
+        valid = counts > 0
+        rms[start:start + step][valid] = np.sqrt(squares[valid] / counts[valid])
+        peak[start:start + step][valid] = maximum[valid]
+    return rms, peak
+
+
+def chunks(data, mask=None, invert=False):
+    """
+    Yields the finite pixel values of the given data in chunks, optionally only where the mask is True (or False if
+    inverted). A bit-packed mask is unpacked one chunk at a time.
+
+    :param data: The image data
+    :param mask: The boolean or bit-packed mask of the selected pixels (None for all pixels)
+    :param invert: Boolean initialized with False, selects the pixels where the mask is False
+    :return: size: The number of pixels in the chunk including NaN
+    :return: chunk: The finite pixel values of the chunk
+    """
+    values = data.reshape(-1)
+    selected = None if mask is None else mask.reshape(-1)
+    for start in range(0, values.size, CHUNK_SIZE):
+        chunk = values[start:start + CHUNK_SIZE]
+        if selected is not None:
+            chunk_mask = chunk_selection(selected, start, chunk.size)
+            chunk = chunk[~chunk_mask if invert else chunk_mask]
+        size = chunk.size
+        # the minimum is NaN only if the chunk holds NaN, which saves a separate isnan pass
+        if size and np.isnan(chunk.min()):
+            chunk = chunk[~np.isnan(chunk)]
+        yield size, chunk
+
+
+def chunk_selection(mask, start, size):
+    """
+    Returns the boolean selection of a chunk of pixels from a boolean or a bit-packed mask.
+
+    :param mask: The flattened boolean mask or the bit-packed mask as returned by np.packbits
+    :param start: The index of the first pixel of the chunk, a multiple of 8 for bit-packed masks
+    :param size: The number of pixels of the chunk
+    :return: selection: The boolean selection of the chunk
+    """
+    if mask.dtype == bool:
+        return mask[start:start + size]
+    return np.unpackbits(mask[start // 8:(start + size + 7) // 8], count=size).view(bool)
+
+
+def bin_values(values, low, high, nbins):
+    """
+    Returns the bin of each value for equally spaced bins between low and high.
+
+    :param values: The finite values
+    :param low: The lower edge of the first bin
+    :param high: The upper edge of the last bin
+    :param nbins: The number of bins
+    :return: index: The bin index of each value
+    """
+    if high == low:
+        return np.zeros(values.shape, dtype='i4')
+    index = ((values - low) * (nbins / (high - low))).astype('i4')
+    return np.minimum(index, nbins - 1, out=index)
+
+
+def fused_stats(data, mask=None, invert=False, nbins=NBINS, median=True, exact=True):
+    """
+    Returns all statistical information of the given data in one record. The first pass over the chunks accumulates
+    count, sum, mean and squared deviations (merged per chunk, numerically stable), minimum and maximum.
+    The second pass counts a fine histogram from which the histogram bins are summed up and the bin holding the median
+    is located; the exact median is then selected from the pixels of that single bin only. Without exact median, the
+    median is interpolated in the fine histogram instead, so memory stays bounded by the chunk size. Scalars shown on
+    the cards are returned in the precision of the data. Pixels are not converted, only the reductions accumulate in
+    double precision.
+
+    :param data: The image data
+    :param mask: The boolean or bit-packed mask of the selected pixels (None for all pixels)
+    :param invert: Boolean initialized with False, selects the pixels where the mask is False
+    :param nbins: The number of histogram bins
+    :param median: Boolean initialized with True, computes the median (otherwise NaN)
+    :param exact: Boolean initialized with True, selects the exact median (otherwise interpolated in the histogram)
+    :return: record: The statistical information
+    """
+    scalar = np.result_type(data.dtype, np.float32).type
+    size = 0
+    count = 0
+    total = 0.0
+    mean = 0.0
+    squares = 0.0
+    minimum = np.inf
+    maximum = -np.inf
+    for chunk_size, chunk in chunks(data, mask, invert):
+        size += chunk_size
+        if chunk.size == 0:
+            continue
+        # chunks are summed in the precision of the data like np.sum, mean and deviations in double precision; the
+        # deviations are taken from the chunk mean rounded to the data type and corrected by their mean
+        total += float(chunk.sum())
+        chunk_mean = chunk.sum(dtype='f8') / chunk.size
+        values = chunk - scalar(chunk_mean)
+        shift = values.sum(dtype='f8')
+        chunk_squares = np.einsum('i,i->', values, values, dtype='f8') - shift ** 2 / chunk.size
+        delta = chunk_mean - mean
+        merged = count + chunk.size
+        squares += chunk_squares + delta ** 2 * count * chunk.size / merged
+        mean += delta * chunk.size / merged
+        count = merged
+        minimum = min(minimum, chunk.min())
+        maximum = max(maximum, chunk.max())
+
+    nan = scalar('nan')
+    if count == 0:
+        return StatsRecord(size, size, 0, nan, nan, nan, nan, nan, scalar(0), nan, nan, np.zeros(nbins, dtype='i8'),
+                           np.linspace(0, 1, nbins + 1))
+
+    fine_bins = nbins * (MEDIAN_BINS // nbins) if median else nbins
+    low, high = float(minimum), float(maximum)
+    fine_counts = np.zeros(fine_bins, dtype='i8')
+    for _, chunk in chunks(data, mask, invert):
+        fine_counts += np.bincount(bin_values(chunk, low, high, fine_bins), minlength=fine_bins)
+    counts = fine_counts.reshape(nbins, -1).sum(axis=1)
+
+    median_value = nan
+    if median and exact:
+        median_value = select_median(data, mask, invert, fine_counts, low, high, count)
+    elif median:
+        median_value = scalar(sketch_median(fine_counts, low, high, count))
+
+    rms = scalar(np.sqrt(squares / count + mean ** 2)).round(4)
+    return StatsRecord(size=size,
+                       nan_count=size - count,
+                       count=count,
+                       max=scalar(maximum),
+                       min=scalar(minimum),
+                       mean=scalar(total / count),
+                       median=median_value,
+                       sigma=scalar(np.sqrt(squares / count)),
+                       sum=scalar(total),
+                       rms=rms,
+                       dr=(scalar(maximum) / rms).round(4),
+                       counts=counts,
+                       edges=np.linspace(low, high, nbins + 1))
+
+
+def select_median(data, mask, invert, fine_counts, low, high, count):
+    """
+    Returns the exact median of the given data. Only the pixels of the fine bins holding the middle values are
+    gathered and partitioned.
+
+    :param data: The image data
+    :param mask: The boolean or bit-packed mask of the selected pixels (None for all pixels)
+    :param invert: Boolean initialized with False, selects the pixels where the mask is False
+    :param fine_counts: The fine histogram counts
+    :param low: The lower edge of the fine histogram
+    :param high: The upper edge of the fine histogram
+    :param count: The number of non-NaN pixels
+    :return: median: The median
+    """
+    fine_bins = len(fine_counts)
+    cumulative = np.cumsum(fine_counts)
+    ranks = np.array([(count - 1) // 2, count // 2])
+    bins = np.searchsorted(cumulative, ranks, side='right')
+    selected = []
+    for _, chunk in chunks(data, mask, invert):
+        index = bin_values(chunk, low, high, fine_bins)
+        selected.append(chunk[(index >= bins[0]) & (index <= bins[1])])
+    selected = np.concatenate(selected)
+    offset = cumulative[bins[0]] - fine_counts[bins[0]]
+    middle = np.partition(selected, ranks - offset)[ranks - offset]
+    return middle.mean()
+
+
+def sketch_median(fine_counts, low, high, count):
+    """
+    Returns the median interpolated in the fine histogram. The values of a bin are assumed to be evenly spread over
+    the bin, so the error is at most the width of one fine bin.
+
+    :param fine_counts: The fine histogram counts
+    :param low: The lower edge of the fine histogram
+    :param high: The upper edge of the fine histogram
+    :param count: The number of non-NaN pixels
+    :return: median: The median
+    """
+    fine_bins = len(fine_counts)
+    width = (high - low) / fine_bins
+    cumulative = np.cumsum(fine_counts)
+    ranks = np.array([(count - 1) // 2, count // 2])
+    bins = np.searchsorted(cumulative, ranks, side='right')
+    before = cumulative[bins] - fine_counts[bins]
+    middle = low + (bins + (ranks - before + 0.5) / fine_counts[bins]) * width
+    return middle.mean()
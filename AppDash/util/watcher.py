@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+
+#########################
+# Run Watcher Object
+#########################
+
+class RunWatcher(threading.Thread):
+    """
+    This class polls the output folder in a background thread and lists new and changed simulation runs, so a running
+    dashboard keeps up with the simulation pipeline without a restart. With a cache, the derived products of the runs
+    are computed into the cache right away, their models are only built when they are selected.
+    """
+
+    def __init__(self, models, interval):
+        """
+        This methods will be called when an object of this class is instantiated. The thread is not started here.
+
+        :param models: The model registry
+        :param interval: The time between two polls in seconds
+        :raises ValueError: The interval is not positive
+        """
+        if not interval > 0:
+            raise ValueError('the interval of the watcher must be positive, got %r' % interval)
+        super().__init__(name='RunWatcher', daemon=True)
+        self.models = models
+        self.interval = interval
+        self.pid = os.getpid()
+        self.stopped = threading.Event()
+
+    def run(self):
+        """
+        Polls the output folder until the watcher is stopped.
+        """
+        while not self.stopped.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        """
+        Rescans the output folder once and warms the cache with the products of all new and changed runs. A failed build
+        is reported and retried when the run changes again.
+        """
+        try:
+            added, changed, removed = self.models.refresh()
+        except OSError as error:
+            print('watcher cannot scan the output folder: ' + str(error))
+            return
+        for folder in removed:
+            print('removed run ' + folder)
+        for folder in added + changed:
+            print(('new run ' if folder in added else 'changed run ') + folder)
+            start_time = time.time()
+            try:
+                warmed = self.models.warm(folder)
+            except Exception as error:
+                print('watcher cannot build model %s: %r' % (folder, error))
+                continue
+            if not warmed:
+                continue
+            print("Time to ingest run %s:" % folder)
+            print("--- %s seconds ---" % (time.time() - start_time))
+
+    def stop(self):
+        """
+        Stops polling after the current poll.
+        """
+        self.stopped.set()
+
+
+def ensure_watching(watcher, models, interval):
+    """
+    Returns a running watcher of the model registry. A new watcher is started if there is none yet or if this process
+    was forked from the process that started it (e.g. a worker of a WSGI server), as threads do not survive a fork.
+
+    :param watcher: The current watcher (None if there is none)
+    :param models: The model registry
+    :param interval: The time between two polls in seconds
+    :return: watcher: The running watcher
+    :raises ValueError: The interval is not positive
+    """
+    if watcher is not None and watcher.pid == os.getpid() and watcher.is_alive():
+        return watcher
+    watcher = RunWatcher(models, interval)
+    watcher.start()
+    return watcher
@@ -0,0 +1,134 @@
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+# Number of threads computing zoomed views
+ZOOM_WORKERS = 4
+
+# Number of computed views kept for repeated zooms
+MEMO_SIZE = 128
+
+
+class Superseded(Exception):
+    """
+    Raised for a request that was replaced by a newer request of the same session and image before it was answered.
+    """
+
+
+#########################
+# Zoom Queue Object
+#########################
+
+class ZoomQueue:
+    """
+    This class computes the views of zoom events in a thread pool. Events are coalesced per key (session and image):
+    a queued request is cancelled when a newer one of the same key arrives, a running one is answered as superseded,
+    so only the latest zoom of a burst is computed and sent. Results are memoized by run, image and rounded region.
+    """
+
+    def __init__(self, workers=ZOOM_WORKERS, memo_size=MEMO_SIZE):
+        """
+        This methods will be called when an object of this class is instantiated. It only initializes variables, the
+        threads are started with the first request.
+
+        :param workers: The number of threads computing views
+        :param memo_size: The number of memoized views
+        """
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='ZoomWorker')
+        self.workers = workers
+        self.memo_size = memo_size
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.latest = dict()
+        self.pending = dict()
+        self.memo = OrderedDict()
+        self.running = 0
+        self.max_queued = 0
+        self.counters = {'submitted': 0, 'completed': 0, 'cancelled': 0, 'superseded': 0, 'memo_hits': 0}
+
+    def run(self, key, memo_key, function, *args):
+        """
+        Returns the result of the given function for the latest request of a key. The function is called in the
+        thread pool unless its result is memoized.
+
+        :param key: The key of coalesced requests, e.g. session and image
+        :param memo_key: The key of the memoized result (None to not memoize it)
+        :param function: The function computing the result
+        :param args: The arguments of the function
+        :return: result: The result of the function
+        :raises Superseded: A newer request of the same key arrived
+        """
+        with self.lock:
+            number = next(self.sequence)
+            previous = self.pending.pop(key, None)
+            if previous is not None and previous[1].cancel():
+                self.counters['cancelled'] += 1
+            if memo_key is not None and memo_key in self.memo:
+                # older requests of the key still running are superseded by this answered one
+                self.latest.pop(key, None)
+                self.memo.move_to_end(memo_key)
+                self.counters['memo_hits'] += 1
+                return self.memo[memo_key]
+            self.latest[key] = number
+            future = self.executor.submit(self.execute, key, number, memo_key, function, args)
+            self.pending[key] = (number, future)
+            self.counters['submitted'] += 1
+            self.max_queued = max(self.max_queued, len(self.pending))
+
+        try:
+            result = future.result()
+        except CancelledError:
+            raise Superseded()
+        with self.lock:
+            if self.latest.get(key) != number:
+                self.counters['superseded'] += 1
+                raise Superseded()
+            del self.latest[key]
+        return result
+
+    def execute(self, key, number, memo_key, function, args):
+        """
+        Computes the result of a request in a thread of the pool, unless a newer request of the same key arrived in
+        the meantime.
+
+        :param key: The key of coalesced requests
+        :param number: The sequence number of the request
+        :param memo_key: The key of the memoized result (None to not memoize it)
+        :param function: The function computing the result
+        :param args: The arguments of the function
+        :return: result: The result of the function
+        """
+        with self.lock:
+            if self.pending.get(key, (None,))[0] == number:
+                del self.pending[key]
+            if self.latest.get(key) != number:
+                self.counters['superseded'] += 1
+                raise Superseded()
+            self.running += 1
+        try:
+            result = function(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+        with self.lock:
+            self.counters['completed'] += 1
+            if memo_key is not None:
+                self.memo[memo_key] = result
+                while len(self.memo) > self.memo_size:
+                    self.memo.popitem(last=False)
+        return result
+
+    def stats(self):
+        """
+        Returns the depth of the queue and the counters of the requests.
+
+        :return: stats: The number of queued and running requests, the largest number of queued requests, the number
+                        of memoized views and the counters of submitted, completed, cancelled and superseded requests
+                        and of memo hits
+        """
+        with self.lock:
+            stats = {'workers': self.workers, 'queued': len(self.pending), 'running': self.running,
+                     'max_queued': self.max_queued, 'memo_entries': len(self.memo)}
+            stats.update(self.counters)
+        return stats
@@ -0,0 +1,18 @@
+"""
+WSGI entry point of the dashboard for serving with several worker processes, e.g. from the repository root:
+    gunicorn --chdir AppDash --workers 4 --preload wsgi:server
+
+Options of app.py are read from the environment variable DASHAPP_OPTIONS, e.g. DASHAPP_OPTIONS="--max-models 8".
+With --preload the first model is built once before the workers are forked, and the fits-files and cached products
+are memory-mapped, so all workers share one copy of the pixel arrays, masks, pyramids and region indices.
+"""
+import os
+import shlex
+import sys
+
+# the options of the WSGI server are not meant for the dashboard
+sys.argv = ['app.py'] + shlex.split(os.environ.get('DASHAPP_OPTIONS', ''))
+
+import app as dashboard
+
+server = dashboard.app.server